@@ -1,20 +1,50 @@
-from flask import Flask, request, jsonify
-import joblib
-import pandas as pd
+import time
+
+# Startup clock, set before the imports it measures, for the import time and
+# time-to-first-prediction reported at startup
+STARTED = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify
+import os
+import threading
 import numpy as np
 from flask_cors import CORS
+from answer_schema import compile_schema
+from forest_engine import compile_predictor
+from metrics import Metrics, cache_metric_lines
+from model_store import ModelStore, serving_filenames
+from prediction_cache import PredictionCache
 
 app = Flask(__name__)
 CORS(app)  # Allows frontend to call backend API
 
-# Load trained models
-models = {
-    "lung_cancer": joblib.load("lung_cancer_model.pkl"),
-    "diabetes": joblib.load("diabetes_model.pkl"),
-    "thyroid_cancer": joblib.load("thyroid_cancer_model.pkl"),
-    "Heart_Disease": joblib.load("heart_disease_model.pkl"),
+# Per-stage latency histograms and counters served at /metrics. Set
+# METRICS_ENABLED=0 to switch the timers off entirely
+metrics = Metrics(os.environ.get("METRICS_ENABLED", "1") != "0")
+
+MODEL_FILES = {
+    "lung_cancer": "lung_cancer_model.pkl",
+    "diabetes": "diabetes_model.pkl",
+    "thyroid_cancer": "thyroid_cancer_model.pkl",
+    "Heart_Disease": "heart_disease_model.pkl",
 }
 
+# Diseases listed in DISTILLED_MODELS (comma separated) are served by the
+# single shallow tree distill.py fitted to mimic their forest, and those in
+# GENERATED_MODELS by the Python module codegen.py generated from their model.
+# Generated modules score rows one at a time in Python, so they only cut
+# single-row latency and are slower than the engine on batches
+SERVED_FILES = serving_filenames(MODEL_FILES, os.environ.get("DISTILLED_MODELS", ""),
+                                 os.environ.get("GENERATED_MODELS", ""))
+
+# Load trained models as memory-mapped engines so worker processes share the
+# same pages; each load time and resident size is printed at startup. With
+# LAZY_MODELS=1 each model is loaded on the first request for its disease
+# instead, for instances that scale to zero and must answer quickly
+LAZY_MODELS = os.environ.get("LAZY_MODELS", "0") != "0"
+store = ModelStore(os.environ.get("MODEL_DIR", "."))
+models = {} if LAZY_MODELS else store.load_all(SERVED_FILES)
+
 # Expected features for each disease
 expected_features = {
     "thyroid_cancer": ["Response", "Adenopathy", "N", "T"],
@@ -23,167 +53,149 @@ expected_features = {
     "Heart_Disease": ['ca', 'cp', 'oldpeak', 'thalach']
 }
 
-# Preprocessing functions for each disease
-def preprocess_thyroid_cancer(data):
-    print(models["thyroid_cancer"].feature_names_in_)
-# Initialize a dictionary with the expected features
-    processed_data = {feature: None for feature in expected_features}
-
-
-    cancer_stage = data.get("How did your cancer respond to treatment?", None)
-    if cancer_stage == "Excellent":
-        processed_data["Response"] = "0"
-    elif cancer_stage == "Indeterminate":
-        processed_data["Response"] = "1"
-    elif cancer_stage == "Biochemical Incomplete":
-        processed_data["Response"] = "2"
-    elif cancer_stage == "Structural":
-        processed_data["Response"] = "3"
-
-    cancer_aden = data.get("Do you have enlarged lymph nodes in your neck?", None)
-    if cancer_aden == "No":
-        processed_data["Adenopathy"] = "0"
-    elif cancer_aden == "Right":
-        processed_data["Adenopathy"] = "1"
-    elif cancer_aden == "Left":
-        processed_data["Adenopathy"] = "1"
-    elif cancer_aden == "Posterior":
-        processed_data["Adenopathy"] = "2"
-    elif cancer_aden == "Bilateral":
-        processed_data["Adenopathy"] = "3"
-    elif cancer_aden == "Extensive":
-        processed_data["Adenopathy"] = "4"
-
-    cancer_Tumor = data.get("What is your tumor classification?", None)
-    if cancer_Tumor == "T1a":
-        processed_data["T"] = "0"
-    elif cancer_Tumor == "T1b":
-        processed_data["T"] = "1"
-    elif cancer_Tumor == "T2":
-        processed_data["T"] = "2"
-    elif cancer_Tumor == "T3a":
-        processed_data["T"] = "3"
-    elif cancer_Tumor == "T3b":
-        processed_data["T"] = "4"
-    elif cancer_Tumor == "T4a":
-        processed_data["T"] = "5"
-    elif cancer_Tumor == "T4b":
-        processed_data["T"] = "6"
-        
-    cancer_spread = data.get("What is your lymph node classification based on cancer staging?", None)
-    if cancer_spread == "N0":
-        processed_data["N"] = "0"
-    elif cancer_spread == "N1a":
-        processed_data["N"] = "1"
-    elif cancer_spread == "N1b":
-        processed_data["N"] = "2"
-
-    # Return the data in the same order as the expected features
-    return [processed_data[feature] for feature in expected_features["thyroid_cancer"]]
-
-def preprocess_lung_cancer(data):
-    
-    print(f"Input data: {data}")
-
-    processed_data = {feature: None for feature in expected_features}
-
-    processed_data["AGE"] = data.get("How old are you?", None)
-
-
-    lung_cancer_peer = data.get("Do you have peer pressure?", None)
-    if lung_cancer_peer == "Yes":
-        processed_data["PEER_PRESSURE"] = "2"
-    elif lung_cancer_peer == "No":
-        processed_data["PEER_PRESSURE"] = "1"
-
-    lung_cancer_allergy = data.get("Do you have allergies?", None)
-    if lung_cancer_allergy == "Yes":
-        processed_data["ALLERGY "] = "2"
-    elif lung_cancer_allergy == "No":
-        processed_data["ALLERGY "] = "1"
-
-
-    lung_cancer_wheeze = data.get("Do you drink alcohol?", None)
-    if lung_cancer_wheeze == "Yes":
-        processed_data["ALCOHOL CONSUMING"] = "2"
-    elif lung_cancer_wheeze == "No":
-        processed_data["ALCOHOL CONSUMING"] = "1"
-    
-
-    return [processed_data[feature] for feature in expected_features["lung_cancer"]]
-
-def preprocess_diabetes(data):
-
-    print(f"Input data: {data}")
-
-    processed_data = {feature: None for feature in expected_features}
-
-    
-    processed_data["BMI"] = data.get("What is your BMI?", None)
-    processed_data["GenHlth"] = data.get("How would you rank your general health (1 is the best, 5 is the worst)", None)
-    processed_data["Age"] = data.get("What is your age?", None)
-    processed_data["Income"] = data.get("Rank your income: \n1 = less than $10k \n5 = less than 35k \n8 = more than 75k", None)
-
-    
-    return [processed_data[feature] for feature in expected_features["diabetes"]]
-
-def preprocess_Heart_Disease(data):
-
-    processed_data = {feature: None for feature in expected_features}
-
-    
-    Heart_cp = data.get("What type of chestpain do you experience?", None)
-    if Heart_cp == "Asymptomatic":
-        processed_data["cp"] = "0"
-    elif Heart_cp == "Typical Angina":
-        processed_data["cp"] = "1"
-    elif Heart_cp == "Atypical Angina":
-        processed_data["cp"] = "2"
-    elif Heart_cp == "Non-Anginal Pain":
-        processed_data["cp"] = "3"
-
-
-    processed_data["thalach"] = data.get("What is your maximum heart rate?", None)
-
-    processed_data["ca"] = data.get("What is the number of major vessels colored by flourosopy?", None)
-
-    processed_data["oldpeak"] = data.get("What is your ST depression induced by exercise relative to rest?", None)
-
-    return [processed_data[feature] for feature in expected_features["Heart_Disease"]]
-
-# Mapping diseases to their preprocessing functions
-preprocessing_functions = {
-    "thyroid_cancer": preprocess_thyroid_cancer,
-    "lung_cancer": preprocess_lung_cancer,
-    "diabetes": preprocess_diabetes,
-    "Heart_Disease": preprocess_Heart_Disease
+# Answer-to-feature encoders compiled once from the shared schema
+encoders = {
+    disease: compile_schema(disease, features)
+    for disease, features in expected_features.items()
+}
+
+# Lookup tables or flat-array engines built from the loaded forests, used for
+# scoring instead of going through sklearn's predict on every request. A model
+# whose features are all bounded categoricals (the thyroid model's
+# 4 x 5 x 3 x 7 = 420 answer combinations) is precompiled into a lookup table
+engines = {
+    disease: compile_predictor(model, expected_features[disease], encoders[disease].domains)
+    for disease, model in models.items()
 }
 
+# Model version of every engine, part of the prediction cache key
+versions = dict(store.versions)
+
+# LRU cache of prediction results for repeated answer sets. Size it with
+# PREDICTION_CACHE_SIZE (0 disables it) and optionally expire entries after
+# PREDICTION_CACHE_TTL seconds
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = os.environ.get("PREDICTION_CACHE_TTL")
+
+cache = None
+if PREDICTION_CACHE_SIZE > 0:
+    cache = PredictionCache(PREDICTION_CACHE_SIZE, float(PREDICTION_CACHE_TTL) if PREDICTION_CACHE_TTL else None)
+
+load_lock = threading.Lock()
+
+def load_model(disease):
+    # Load a disease's model on its first request (LAZY_MODELS). The engine
+    # is published last, so a disease found in engines is ready to serve
+    if disease in engines:
+        return
+    with load_lock:
+        if disease in engines:
+            return
+        mark = metrics.now()
+        models[disease] = store.load(SERVED_FILES[disease], disease)
+        versions[disease] = store.versions[disease]
+        engines[disease] = compile_predictor(models[disease], expected_features[disease], encoders[disease].domains)
+        metrics.lap("load", disease, mark)
+        print(f"Loaded {disease} on first request: {store.stats[disease]['load_ms']:.1f} ms")
+
 @app.route('/predict', methods=['POST'])
 def predict():
+    disease = None
+    started = metrics.now()
     try:
         data = request.json  # Receive JSON data
         disease = data.get("disease")
-        answers = data.get("answers")
+        answers = data.get("answers") or {}
 
-        if disease not in models:
+        if disease not in SERVED_FILES:
+            metrics.count("errors", None)
             return jsonify({"error": "Invalid disease type"}), 400
 
-        # Preprocess the input based on the selected disease
-        input_data = preprocessing_functions[disease](answers)
-
-        # Create DataFrame with the correct columns
-        input_df = pd.DataFrame([input_data], columns=expected_features[disease])
-
-        # Make the prediction
-        prediction = models[disease].predict(input_df)[0]
+        metrics.count("requests", disease)
+        mark = metrics.lap("parse", disease, started)
+        load_model(disease)
+
+        # Encode the answers straight into a feature row ordered like expected_features.
+        # Malformed answers (lists, objects, unknown codes) are the client's error
+        try:
+            input_row = encoders[disease].encode(answers)
+        except (AttributeError, TypeError, ValueError) as e:
+            metrics.count("errors", disease)
+            return jsonify({"error": f"Invalid answers: {e}"}), 400
+        mark = metrics.lap("preprocess", disease, mark)
+
+        # Make the prediction, skipping the forest for repeated answer sets.
+        # The version is read before the engine so a concurrent reload can
+        # only ever cache a result under the version it replaces
+        version = versions[disease]
+        probabilities = cache.get(disease, version, input_row) if cache is not None else None
+        if probabilities is None:
+            probabilities = engines[disease].predict_proba(input_row)[0]
+            if cache is not None:
+                cache.put(disease, version, input_row, probabilities)
+
+        prediction = engines[disease].classes_[np.argmax(probabilities)]
         result = "Positive" if prediction == 1 else "Negative"
+        metrics.lap("predict", disease, mark)
+        metrics.count("rows_scored", disease)
+        metrics.lap("total", disease, started)
 
         return jsonify({"disease": disease, "prediction": result})
 
+    except ValueError as e:
+        metrics.count("errors", disease)
+        return jsonify({"error": str(e)}), 400
+
     except Exception as e:
         print("Error:", str(e))
+        metrics.count("errors", disease)
         return jsonify({"error": "Internal server error"}), 500
 
+def reload_models():
+    # Swap in every model whose file changed on disk. The cache drops the old
+    # version's entries as soon as it sees the new version. Holding load_lock
+    # keeps a first load (LAZY_MODELS) from being half published meanwhile
+    reloaded = []
+    with load_lock:
+        for disease in list(models):
+            model = store.refresh(disease)
+            if model is None:
+                continue
+            models[disease] = model
+            engines[disease] = compile_predictor(model, expected_features[disease], encoders[disease].domains)
+            versions[disease] = store.versions[disease]
+            reloaded.append(disease)
+    return reloaded
+
+@app.route('/reload', methods=['POST'])
+def reload():
+    return jsonify({"reloaded": reload_models()})
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(cache.stats() if cache is not None else {"enabled": False})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    extra = cache_metric_lines(cache) if cache is not None else []
+    return Response(metrics.render(extra), mimetype="text/plain; version=0.0.4")
+
+# Time to the first scored request, reported once
+first_prediction_lock = threading.Lock()
+first_prediction_reported = False
+
+@app.after_request
+def report_first_prediction(response):
+    global first_prediction_reported
+    if not first_prediction_reported and response.status_code == 200 and request.endpoint == "predict":
+        with first_prediction_lock:
+            if not first_prediction_reported:
+                first_prediction_reported = True
+                print(f"First prediction served {(time.perf_counter() - STARTED) * 1000:.0f} ms after startup")
+    return response
+
+print(f"Imported in {(time.perf_counter() - STARTED) * 1000:.0f} ms"
+      + (" (models load on first request)" if LAZY_MODELS else ""))
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,229 @@
+import numpy as np
+
+
+# Answer codes shared by several questions
+YES_NO = {"Yes": 1, "No": 0}
+GENDER = {"Male": 1, "Female": 0}
+
+# The lung cancer survey codes yes/no as 2/1
+LUNG_YES_NO = {"Yes": 2, "No": 1}
+
+# Declarative answer-to-feature schema for every disease. Each feature column
+# maps to the question that fills it and the code of every accepted answer.
+# Features whose codes are None take the answer as a number. The short and
+# full models read the columns they need from the same entries.
+SCHEMA = {
+    "thyroid_cancer": {
+        "Age": ("How old are you?", None),
+        "Gender": ("What is your gender?", GENDER),
+        "Smoking": ("Do you currently smoke?", YES_NO),
+        "Hx Smoking": ("Do you currently smoke?", YES_NO),
+        "Hx Radiotherapy": ("Have you ever smoked?", YES_NO),
+        "Physical Examination": ("What are the results of your physical examination?", {
+            "Normal": 0, "Diffuse goiter": 1, "Single nodular goiter-left": 2,
+            "Single nodular goiter-right": 3, "Multinodular goiter": 4}),
+        "Adenopathy": ("Do you have enlarged lymph nodes in your neck?", {
+            "No": 0, "Right": 1, "Left": 1, "Posterior": 2, "Bilateral": 3, "Extensive": 4}),
+        "Pathology": ("What is the pathology results of your thyroid biopsy?", {
+            "Micropapillary": 0, "Micropapillary ": 0, "Papillary": 1, "Follicular": 2,
+            "Hurthle cell": 3}),
+        "Focality": ("Is your thyroid cancer unifocal or multifocal?", {
+            "Uni-Focal": 0, "Multi-Focal": 1}),
+        "T": ("What is your tumor classification?", {
+            "T1a": 0, "T1b": 1, "T2": 2, "T3a": 3, "T3b": 4, "T4a": 5, "T4b": 6}),
+        "N": ("What is your lymph node classification based on cancer staging?", {
+            "N0": 0, "N1a": 1, "N1b": 2}),
+        "M": ("Has your cancer spread to distant organs?", YES_NO),
+        "Stage": ("What is your stage of cancer?", {
+            "I": 0, "II": 1, "III": 2, "IVA": 3, "IVB": 4}),
+        "Response": ("How did your cancer respond to treatment?", {
+            "Excellent": 0, "Indeterminate": 1, "Biochemical Incomplete": 2,
+            "Structural Incomplete": 3, "Structural": 3}),
+    },
+    "lung_cancer": {
+        "GENDER": ("What is your gender?", GENDER),
+        "AGE": ("How old are you?", None),
+        "SMOKING": ("Have you smoked over 100 cigarettes?", LUNG_YES_NO),
+        "YELLOW_FINGERS": ("Do you have yellowish fingers?", LUNG_YES_NO),
+        "ANXIETY": ("Do you have anxiety?", LUNG_YES_NO),
+        "PEER_PRESSURE": ("Do you have peer pressure?", LUNG_YES_NO),
+        "CHRONIC DISEASE": ("Do you have Chronic Diseases?", LUNG_YES_NO),
+        "FATIGUE ": ("Are you constantly fatigued?", LUNG_YES_NO),
+        "ALLERGY ": ("Do you have allergies?", LUNG_YES_NO),
+        "WHEEZING": ("Do you constantly wheeze?", LUNG_YES_NO),
+        "ALCOHOL CONSUMING": ("Do you drink alcohol?", LUNG_YES_NO),
+        "COUGHING": ("Do you constantly cough?", LUNG_YES_NO),
+        "SHORTNESS OF BREATH": ("Do you have shortness of breath?", LUNG_YES_NO),
+        "SWALLOWING DIFFICULTY": ("Do you have difficulty swallowing?", LUNG_YES_NO),
+        "CHEST PAIN": ("Do you have chest pain?", LUNG_YES_NO),
+    },
+    "diabetes": {
+        "HighBP": ("Do you have high Blood Pressure?", YES_NO),
+        "HighChol": ("Do you have high Cholesterol?", YES_NO),
+        "CholCheck": ("Have you had a Cholesterol Check in the past 5 years?", YES_NO),
+        "BMI": ("What is your BMI?", None),
+        "Smoker": ("Have you smoked over 100 cigaretes?", YES_NO),
+        "Stroke": ("Have you had a stroke?", YES_NO),
+        "HeartDiseaseorAttack": ("Do you have a Coronary Heart Disease or Myocardial Infarction?", YES_NO),
+        "PhysActivity": ("Do you exercise frequently?", YES_NO),
+        "Fruits": ("Do you eat a daily serving of fruits?", YES_NO),
+        "Veggies": ("Do you eat a daily serving of vegetables?", YES_NO),
+        "HvyAlcoholConsump": ("Do you drink heavy alcohol?", YES_NO),
+        "AnyHealthcare": ("Do you have any kind of healthcare coverage?", YES_NO),
+        "NoDocbcCost": ("Was there a time in the past year when you needed to see a doctor but did not because of its cost?", YES_NO),
+        "GenHlth": ("How would you rank your general health (1 is the best, 5 is the worst)", None),
+        "MentHlth": ("How many days for the past 30 days was your mental health not good", None),
+        "PhysHlth": ("How many days for the past 30 days was your physical health not good", None),
+        "DiffWalk": ("Do you have serious difficulty walking or climbing stairs?", YES_NO),
+        "Sex": ("What is you gender?", GENDER),
+        "Age": ("What is your age?", None),
+        "Education": ("Rank your education: \n1 = Never attended school or only kindergarten \n2 = Grades 1-8 (Elementary) \n3 = Grades 9-11 (Some high school) \n4 = Grade 12 or GED (High school graduate)  \n5 = College 1-3 years (Some college or technical school)  \n6 = College 4 years+ (College graduate)", None),
+        "Income": ("Rank your income: \n1 = less than $10k \n5 = less than 35k \n8 = more than 75k", None),
+    },
+    "Heart_Disease": {
+        "age": ("What is your age", None),
+        "sex": ("What is your gender?", GENDER),
+        "cp": ("What type of chestpain do you experience?", {
+            "Asymptomatic": 0, "Typical Angina": 1, "Atypical Angina": 2, "Non-Anginal Pain": 3}),
+        "trestbps": ("What is your resting blood pressure (mmHg)?", None),
+        "chol": ("What is your cholesterol level (mg/dL)?", None),
+        "fbs": ("Is you fasting blood sugar more than 120 mg/dL?", YES_NO),
+        "restecg": ("What are your resting electrocardiographic results?", {
+            "Normal": 0, "ST-T wave abnormality": 1, "Left ventricular hypertrophy": 2}),
+        "thalach": ("What is your maximum heart rate?", None),
+        "exang": ("Do you experience exercise induced angina?", YES_NO),
+        "oldpeak": ("What is your ST depression induced by exercise relative to rest?", None),
+        "slope": ("What is the slope of your peak exercise segment?", {
+            "Flat": 0, "Upsloping": 1, "Downsloping": 2}),
+        "ca": ("What is the number of major vessels colored by flourosopy?", None),
+        "thal": ("What is the thalassemia type?", {
+            "Normal": 0, "Fixed Defect": 1, "Reversable Defect": 2, "Reversible Defect": 2}),
+    },
+}
+
+
+# Answers the servers accept besides the ones in the training data (typos and
+# shortened wordings the frontends send). They share a code with a training
+# answer and are left out of the encodings train.py derives from SCHEMA.
+SERVING_ALIASES = {
+    "thyroid_cancer": {
+        "Pathology": ("Micropapillary ",),
+        "Response": ("Structural",),
+    },
+    "Heart_Disease": {
+        "thal": ("Reversible Defect",),
+    },
+}
+
+
+def training_codes(disease, feature):
+    # Code of every value the training data holds for a categorical feature
+    _, codes = SCHEMA[disease][feature]
+    aliases = SERVING_ALIASES.get(disease, {}).get(feature, ())
+    return {answer: code for answer, code in codes.items() if answer not in aliases}
+
+
+def training_labels(disease, feature, values=None):
+    # Label categories of a feature ordered by answer code. values maps each
+    # answer to how the training data spells it, when that differs
+    codes = training_codes(disease, feature)
+    if values is None:
+        values = {answer: answer for answer in codes}
+    if set(values) != set(codes) or sorted(codes.values()) != list(range(len(codes))):
+        raise ValueError(f"{disease} {feature!r} values {values} do not cover codes {codes}")
+    return [values[answer] for answer in sorted(codes, key=codes.get)]
+
+
+# Schema for one disease compiled against the column order of one model.
+# Categorical and numeric features are kept in separate tuples of
+# (position, question, codes) so encoding a request is a handful of dict
+# lookups writing straight into a float array.
+class CompiledSchema:
+
+    def __init__(self, disease, features):
+        entries = SCHEMA[disease]
+        unknown = [feature for feature in features if feature not in entries]
+        if unknown:
+            raise ValueError(f"No schema entry for {disease} features {unknown}")
+
+        self.disease = disease
+        self.features = list(features)
+        self.n_features = len(self.features)
+
+        categorical = []
+        numeric = []
+        self.domains = {}
+        for position, feature in enumerate(self.features):
+            question, codes = entries[feature]
+            if codes is None:
+                numeric.append((position, question))
+            else:
+                categorical.append((position, question, {answer: float(code) for answer, code in codes.items()}))
+                self.domains[feature] = max(codes.values()) + 1
+
+        self.categorical = tuple(categorical)
+        self.numeric = tuple(numeric)
+        self.questions = tuple(entries[feature][0] for feature in self.features)
+
+    def encode(self, answers, out=None):
+        # Missing answers become NaN; an answer outside a question's codes or a
+        # non-numeric answer to a numeric question raises ValueError, and so
+        # does a request that answers none of the questions: a row of NaN
+        # would still get a score, from the trees' missing-value branches
+        if out is None:
+            out = np.empty(self.n_features)
+
+        for position, question, codes in self.categorical:
+            answer = answers.get(question)
+            if answer is None:
+                out[position] = np.nan
+                continue
+            code = codes.get(answer)
+            if code is None:
+                raise ValueError(f"Unrecognized answer {answer!r} to {question!r}")
+            out[position] = code
+
+        for position, question in self.numeric:
+            answer = answers.get(question)
+            out[position] = np.nan if answer is None else float(answer)
+
+        if np.isnan(out).all():
+            raise ValueError(f"No answers to any {self.disease} question")
+        return out
+
+    def encode_many(self, answer_sets):
+        out = np.empty((len(answer_sets), self.n_features))
+        for row, answers in zip(out, answer_sets):
+            self.encode(answers, row)
+        return out
+
+    def missing(self, answers):
+        return [question for question in dict.fromkeys(self.questions) if answers.get(question) is None]
+
+
+def compile_schema(disease, features):
+    return CompiledSchema(disease, features)
+
+
+# Questions that different diseases ask with the same meaning and the same
+# answers. An answer to any one of them fills in the others when scoring
+# several diseases from one combined answer set. The diabetes "What is your
+# age?" question is left out on purpose: that model takes the BRFSS age
+# category, not an age in years.
+SHARED_QUESTIONS = {
+    "age": ("How old are you?", "What is your age"),
+    "gender": ("What is your gender?", "What is you gender?"),
+    "smoked_100_cigarettes": ("Have you smoked over 100 cigarettes?", "Have you smoked over 100 cigaretes?"),
+}
+
+
+def share_answers(answers):
+    combined = dict(answers)
+    for questions in SHARED_QUESTIONS.values():
+        answer = next((answers[question] for question in questions if answers.get(question) is not None), None)
+        if answer is None:
+            continue
+        for question in questions:
+            if combined.get(question) is None:
+                combined[question] = answer
+    return combined
@@ -0,0 +1,84 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import Histogram
+
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+# Coalesces concurrent single-row requests for one predictor into batched
+# predict_proba calls. A background thread takes whatever is queued once
+# max_batch rows are waiting or the oldest row has waited max_wait seconds,
+# scores them in one call and hands every caller its own row of the result.
+class MicroBatcher:
+
+    def __init__(self, predictor, max_batch=64, max_wait=0.002, name="batcher"):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.queue_depth = Histogram(BATCH_BUCKETS)
+        self.batch_size = Histogram(BATCH_BUCKETS)
+
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, row):
+        future = Future()
+        with self.condition:
+            self.queue.append((time.monotonic(), row, future))
+            depth = len(self.queue)
+            self.condition.notify()
+        self.queue_depth.observe(depth)
+        return future
+
+    def predict_proba(self, row, timeout=None):
+        return self.submit(row).result(timeout)
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+
+            # The deadline is set by the oldest queued row, so no caller waits
+            # longer than max_wait for its batch to start
+            deadline = self.queue[0][0] + self.max_wait
+            while len(self.queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            size = min(len(self.queue), self.max_batch)
+            return [self.queue.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self.batch_size.observe(len(batch))
+            futures = [future for _, _, future in batch]
+
+            try:
+                rows = np.vstack([row for _, row, _ in batch])
+                probabilities = self.predictor.predict_proba(rows)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, probability in zip(futures, probabilities):
+                future.set_result(probability)
@@ -0,0 +1,296 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.metrics import roc_auc_score
+
+import train
+from answer_schema import SCHEMA, compile_schema
+from forest_engine import compile_predictor
+from model_store import ModelStore
+
+
+# Rows in each real dataset; --scale multiplies them
+DATASET_ROWS = {"diabetes": 253680, "Heart_Disease": 1025, "lung_cancer": 309, "thyroid_cancer": 383}
+
+# Value ranges of the numeric features; categorical features take the codes
+# of their answers in the answer schema
+NUMERIC_RANGES = {
+    "thyroid_cancer": {"Age": (15, 82)},
+    "lung_cancer": {"AGE": (21, 87)},
+    "diabetes": {"BMI": (12, 98), "GenHlth": (1, 5), "MentHlth": (0, 30), "PhysHlth": (0, 30),
+                 "Age": (1, 13), "Education": (1, 6), "Income": (1, 8)},
+    "Heart_Disease": {"age": (29, 77), "trestbps": (94, 200), "chol": (126, 564), "thalach": (71, 202),
+                      "oldpeak": (0, 6.2), "ca": (0, 4)},
+}
+
+# Server module for each variant, and the directory its models are put in
+SERVERS = {"short": "Extra", "full": "Extraa"}
+
+
+def synthetic_dataset(disease, variant, rows, rng):
+    # Encoded features shaped like the real dataset and a label that
+    # depends on a few of them, so the trees grow to a realistic size
+    features = train.CONFIG[disease]["variants"][variant]["features"]
+    columns = {}
+    for feature in features:
+        if feature in NUMERIC_RANGES[disease]:
+            low, high = NUMERIC_RANGES[disease][feature]
+            values = rng.uniform(low, high, rows)
+            columns[feature] = values if isinstance(high, float) else np.round(values)
+        else:
+            codes = sorted(set(SCHEMA[disease][feature][1].values()))
+            columns[feature] = rng.choice(codes, rows).astype(float)
+    X = pd.DataFrame(columns)
+    standardized = (X - X.mean()) / X.std().replace(0, 1)
+    weights = rng.normal(size=len(features)) * (rng.random(len(features)) < 0.5)
+    y = (standardized.to_numpy() @ weights + rng.normal(size=rows) > 0).astype(int)
+    return X, pd.Series(y, name=train.CONFIG[disease]["target"])
+
+
+def answer_sets(disease, X, count, rng):
+    # Turn feature rows back into questionnaire answers for the servers
+    schema = compile_schema(disease, list(X.columns))
+    answers = []
+    for row in X.iloc[rng.integers(0, len(X), count)].to_numpy():
+        answer = {}
+        for position, question, codes in schema.categorical:
+            inverse = {code: text for text, code in reversed(codes.items())}
+            answer[question] = inverse[row[position]]
+        for position, question in schema.numeric:
+            answer[question] = float(row[position])
+        answers.append(answer)
+    return answers
+
+
+def percentiles_ms(timings):
+    timings = np.asarray(timings) * 1000
+    return {"p50_ms": float(np.percentile(timings, 50)), "p99_ms": float(np.percentile(timings, 99))}
+
+
+def time_calls(function, inputs):
+    timings = []
+    for value in inputs:
+        start = time.perf_counter()
+        function(value)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_model(disease, variant, X, y, model_dir, rng, estimator="forest", repeats=100, batch_size=1000):
+    # The last fifth of the rows is held out for the AUC
+    train_rows = len(X) * 4 // 5
+    start = time.perf_counter()
+    model = train.build_estimator(disease, estimator).fit(X[:train_rows], y[:train_rows])
+    fit_seconds = time.perf_counter() - start
+    auc = roc_auc_score(y[train_rows:], model.predict_proba(X[train_rows:])[:, 1])
+
+    path = train.model_path(disease, variant, model_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    joblib.dump(model, path)
+    start = time.perf_counter()
+    joblib.load(path)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # The engine artifact the servers load, read in full rather than mapped
+    store = ModelStore(os.path.dirname(path), mmap=False)
+    artifact = store.convert(os.path.basename(path))
+    start = time.perf_counter()
+    engine = joblib.load(artifact)
+    artifact_load_ms = (time.perf_counter() - start) * 1000
+
+    # sklearn on a one-row DataFrame, and the predictor the servers build
+    schema = compile_schema(disease, list(X.columns))
+    predictor = compile_predictor(engine, list(X.columns), schema.domains)
+    rows = X.to_numpy(dtype=np.float64)
+    singles = rows[rng.integers(0, len(rows), repeats)]
+    batches = [rows[rng.integers(0, len(rows), batch_size)] for _ in range(max(5, repeats // 10))]
+    predictor.predict_proba(singles[:1])
+
+    result = {
+        "rows": len(X),
+        "auc": auc,
+        "fit_seconds": fit_seconds,
+        "pickle_kb": os.path.getsize(path) / 1024,
+        "load_ms": load_ms,
+        "artifact_kb": os.path.getsize(artifact) / 1024,
+        "artifact_load_ms": artifact_load_ms,
+        "sklearn_single": percentiles_ms(time_calls(
+            lambda row: model.predict_proba(pd.DataFrame(row[None, :], columns=X.columns)), singles)),
+        "sklearn_batch": percentiles_ms(time_calls(
+            lambda batch: model.predict_proba(pd.DataFrame(batch, columns=X.columns)), batches)),
+        "engine": type(predictor).__name__,
+        "engine_single": percentiles_ms(time_calls(lambda row: predictor.predict_proba(row[None, :]), singles)),
+        "engine_batch": percentiles_ms(time_calls(predictor.predict_proba, batches)),
+    }
+    print(f"{disease}/{variant}/{estimator}: fit {fit_seconds:.2f} s, AUC {auc:.3f}, "
+          f"pickle {result['pickle_kb']:.0f} kB / {load_ms:.1f} ms, "
+          f"artifact {result['artifact_kb']:.0f} kB / {artifact_load_ms:.1f} ms, "
+          f"single p50 sklearn {result['sklearn_single']['p50_ms']:.2f} ms / "
+          f"{result['engine']} {result['engine_single']['p50_ms']:.3f} ms")
+    return result
+
+
+def bench_server(module_name, model_dir, answers, requests=500):
+    # /predict throughput through the Flask test client, with the
+    # prediction cache off so every request is scored
+    os.environ["MODEL_DIR"] = model_dir
+    os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    sys.modules.pop(module_name, None)
+    # The model load report printed at import is not part of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = importlib.import_module(module_name)
+    client = server.app.test_client()
+
+    results = {}
+    for disease, answer_list in answers.items():
+        bodies = [{"disease": disease, "answers": answer_list[i % len(answer_list)]} for i in range(requests)]
+        client.post('/predict', json=bodies[0])
+        start = time.perf_counter()
+        timings = []
+        for body in bodies:
+            begin = time.perf_counter()
+            response = client.post('/predict', json=body)
+            timings.append(time.perf_counter() - begin)
+            if response.status_code != 200:
+                raise RuntimeError(f"{module_name} /predict failed for {disease}: {response.get_json()}")
+        elapsed = time.perf_counter() - start
+        results[disease] = {"requests_per_second": requests / elapsed, **percentiles_ms(timings)}
+        print(f"{module_name} /predict {disease}: {results[disease]['requests_per_second']:.0f} req/s, "
+              f"p99 {results[disease]['p99_ms']:.2f} ms")
+    return results
+
+
+def bench_cold_start(module_name, model_dir, disease, answers, lazy):
+    # Wall time from starting a fresh interpreter to the first /predict
+    # response: what a scaled-to-zero instance adds to its first request
+    script = ("import json, sys; server = __import__(sys.argv[1]); "
+              "response = server.app.test_client().post('/predict', json=json.loads(sys.argv[2])); "
+              "sys.exit(response.status_code != 200)")
+    environment = {**os.environ, "MODEL_DIR": model_dir, "LAZY_MODELS": "1" if lazy else "0"}
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", script, module_name, json.dumps({"disease": disease, "answers": answers})],
+                   env=environment, cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def print_comparison(results, estimators):
+    # One line per model and backend, to pick the backend per disease
+    print(f"{'model':28} {'backend':8} {'AUC':>6} {'fit s':>8} {'kB':>9} {'1-row ms':>9} {'batch ms':>9}")
+    for key in dict.fromkeys(key.rsplit("/", 1)[0] for key in results["models"]):
+        for estimator in estimators:
+            result = results["models"].get(f"{key}/{estimator}")
+            if result is None:
+                continue
+            print(f"{key:28} {estimator:8} {result['auc']:6.3f} {result['fit_seconds']:8.2f} "
+                  f"{result['pickle_kb']:9.0f} {result['engine_single']['p50_ms']:9.3f} "
+                  f"{result['engine_batch']['p50_ms']:9.2f}")
+
+
+def flatten(results, prefix=""):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[f"{prefix}{key}"] = value
+    return values
+
+
+def regressions(results, baseline, threshold):
+    # Times and sizes may not grow, throughput may not drop, by more than
+    # threshold (a fraction) against the baseline run. p99 values are kept
+    # in the results but too noisy over a few hundred calls to gate on
+    current = flatten({"models": results["models"], "servers": results["servers"]})
+    previous = flatten({"models": baseline["models"], "servers": baseline["servers"]})
+    found = []
+    for key, old in previous.items():
+        new = current.get(key)
+        if new is None or old <= 0 or key.endswith((".rows", ".auc", ".p99_ms")):
+            continue
+        if key.endswith("requests_per_second"):
+            worse = new < old * (1 - threshold)
+        else:
+            worse = new > old * (1 + threshold)
+        if worse:
+            found.append(f"{key}: {old:.4g} -> {new:.4g}")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark fitting, loading and serving every model on synthetic data")
+    parser.add_argument("--scale", type=float, default=1.0, help="fraction of the real dataset sizes to generate")
+    parser.add_argument("--variants", nargs="+", choices=train.VARIANTS, default=list(train.VARIANTS))
+    parser.add_argument("--estimators", nargs="+", choices=list(train.ESTIMATORS), default=["forest"],
+                        help="backends to compare head to head")
+    parser.add_argument("--repeats", type=int, default=100, help="single-row predictions timed per model")
+    parser.add_argument("--requests", type=int, default=500, help="/predict requests per disease and server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench.json", help="results file")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    results = {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "sklearn": sklearn.__version__, "cpus": os.cpu_count(), "scale": args.scale},
+        "models": {},
+        "servers": {},
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        for variant in args.variants:
+            # Every backend is trained on the same synthetic rows
+            datasets = {disease: synthetic_dataset(disease, variant, max(50, int(DATASET_ROWS[disease] * args.scale)), rng)
+                        for disease in train.CONFIG}
+            answers = {disease: answer_sets(disease, X, 100, rng) for disease, (X, _) in datasets.items()}
+            for estimator in args.estimators:
+                model_dir = os.path.join(directory, estimator, "{variant}")
+                for disease, (X, y) in datasets.items():
+                    results["models"][f"{disease}/{variant}/{estimator}"] = bench_model(
+                        disease, variant, X, y, model_dir, rng, estimator, args.repeats)
+                server = f"{SERVERS[variant]}/{estimator}"
+                results["servers"][server] = bench_server(
+                    SERVERS[variant], model_dir.format(variant=variant), answers, args.requests)
+                results["servers"][server]["cold_start"] = {
+                    f"{mode}_ms": bench_cold_start(SERVERS[variant], model_dir.format(variant=variant),
+                                                   "lung_cancer", answers["lung_cancer"][0], mode == "lazy")
+                    for mode in ("eager", "lazy")
+                }
+                print(f"{SERVERS[variant]} cold start to first prediction: "
+                      f"{results['servers'][server]['cold_start']['eager_ms']:.0f} ms, "
+                      f"{results['servers'][server]['cold_start']['lazy_ms']:.0f} ms with LAZY_MODELS=1")
+
+    if len(args.estimators) > 1:
+        print_comparison(results, args.estimators)
+
+    with open(args.out, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print("Wrote", args.out)
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            found = regressions(results, json.load(handle), args.threshold)
+        if found:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for line in found:
+                print("  " + line)
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import train
+from forest_engine import ForestEngine, compact
+from model_store import ModelStore, boundary_rows, distilled_filename, generated_filename, load_module
+
+
+# Subtrees deeper than this move into helper functions, well inside Python's
+# limit of 100 indentation levels
+SPLIT_DEPTH = 24
+
+# Module template; predict_proba walks every tree of a row in plain Python,
+# then sums the leaf rows tree by tree exactly as ForestEngine does. The
+# per-row walk is what makes single rows fast and batches slower than the
+# engine (see model_store.serving_filenames)
+FOOTER = '''
+TREES = ({trees})
+
+
+def predict_proba(X):
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    leaves = np.array([[tree(x) for tree in TREES] for x in X.tolist()], dtype=np.intp).reshape(len(X), len(TREES))
+    proba = np.add.accumulate(VALUES[leaves.T], axis=0)[-1]
+    proba /= len(TREES)
+    return proba
+
+
+def predict(X):
+    return classes_.take(np.argmax(predict_proba(X), axis=1))
+'''
+
+
+def tree_functions(engine, tree, split_depth=SPLIT_DEPTH):
+    # Nested ifs for one tree of a CompactForestEngine, returning the row of
+    # the leaf in VALUES. Rows are Python floats holding float32 values and
+    # the thresholds are float32 too, so every comparison matches the engine.
+    # Missing values fail every comparison, so where they go left the test
+    # is written as "not x > t"
+    functions = []
+    pending = [(f"_tree_{tree}", int(engine.roots[tree]))]
+    while pending:
+        name, top = pending.pop(0)
+        lines = [f"def {name}(x):"]
+        stack = [(top, 1)]
+        while stack:
+            node, depth = stack.pop()
+            indent = "    " * depth
+            if isinstance(node, str):
+                lines.append(indent[4:] + node)
+            elif np.isnan(engine.threshold[node]):
+                lines.append(f"{indent}return {int(engine.leaf_value[node])}")
+            elif depth > split_depth:
+                helper = f"_tree_{tree}_{node}"
+                pending.append((helper, node))
+                lines.append(f"{indent}return {helper}(x)")
+            else:
+                feature, threshold = int(engine.feature[node]), float(engine.threshold[node])
+                test = (f"not x[{feature}] > {threshold!r}" if engine.missing_left[node]
+                        else f"x[{feature}] <= {threshold!r}")
+                lines.append(f"{indent}if {test}:")
+                stack.extend([(int(engine.right[node]), depth + 1), ("else:", depth + 1),
+                              (node + 1, depth + 1)])
+        functions.append("\n".join(lines))
+    return functions
+
+
+def generate(model, feature_names, source, source_version, split_depth=SPLIT_DEPTH):
+    # Source of an importable module with the interface of an engine:
+    # classes_, feature_names, predict_proba and predict, needing only numpy
+    engine = compact(ForestEngine.from_model(model, feature_names))
+    parts = [
+        f"# Generated by codegen.py from {source}; regenerate instead of editing",
+        "import numpy as np",
+        "",
+        f"SOURCE = {source!r}",
+        f"SOURCE_VERSION = {source_version!r}",
+        f"classes_ = np.array({engine.classes_.tolist()!r})",
+        f"feature_names = {list(engine.feature_names) if engine.feature_names is not None else None!r}",
+        f"VALUES = np.array({engine.value.tolist()!r})",
+    ]
+    names = []
+    for tree in range(engine.n_trees):
+        functions = tree_functions(engine, tree, split_depth)
+        parts.extend(["", ""] + ["\n\n\n".join(functions)])
+        names.append(f"_tree_{tree}")
+    parts.append("\n" + FOOTER.format(trees=", ".join(names) + ("," if len(names) == 1 else "")))
+    return "\n".join(parts)
+
+
+def parity(model, module, n_rows=2000, seed=0):
+    # The generated module against sklearn's predict_proba on random rows:
+    # values on and next to every split threshold (some missing) and values
+    # spread uniformly over each feature's threshold range
+    engine = ForestEngine.from_model(model)
+    rng = np.random.default_rng(seed)
+    around = boundary_rows(engine, n_rows, seed)
+    internal = engine.left != np.arange(len(engine.left))
+    low = np.array([engine.threshold[internal & (engine.feature == column)].min(initial=0) - 1
+                    for column in range(around.shape[1])])
+    high = np.array([engine.threshold[internal & (engine.feature == column)].max(initial=0) + 1
+                     for column in range(around.shape[1])])
+    rows = np.vstack([around, rng.uniform(low, high, (n_rows, len(low))).astype(np.float32)])
+
+    # A distilled tree regressor predicts the probabilities themselves
+    names = getattr(model, "feature_names_in_", None)
+    predict = model.predict_proba if hasattr(model, "predict_proba") else model.predict
+    expected = predict(pd.DataFrame(rows, columns=names) if names is not None else rows)
+    actual = module.predict_proba(rows)
+    return np.array_equal(expected, actual), len(rows)
+
+
+def export(path, split_depth=SPLIT_DEPTH, max_nodes=200_000, n_rows=2000):
+    # Write the module next to the model, but only after it imported and
+    # passed the parity test from a temporary file
+    directory, filename = os.path.split(path)
+    model = joblib.load(path)
+    n_nodes = sum(tree.tree_.node_count for tree in getattr(model, "estimators_", [model]))
+    if n_nodes > max_nodes:
+        raise ValueError(f"{filename} has {n_nodes} nodes, more than --max-nodes {max_nodes}; "
+                         f"distill.py can fit a single tree to generate instead")
+
+    start = time.perf_counter()
+    names = getattr(model, "feature_names_in_", None)
+    source = generate(model, list(names) if names is not None else None, filename,
+                      ModelStore(directory or ".").version(filename), split_depth)
+    out = os.path.join(directory, generated_filename(filename))
+    handle, temporary = tempfile.mkstemp(dir=directory or ".", suffix=".py")
+    try:
+        with os.fdopen(handle, "w") as stream:
+            stream.write(source)
+        import_start = time.perf_counter()
+        module = load_module(temporary)
+        import_ms = (time.perf_counter() - import_start) * 1000
+        identical, checked = parity(model, module, n_rows)
+        if not identical:
+            raise ValueError(f"{filename}: the generated module's predictions differ from sklearn's")
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, out)
+    finally:
+        for leftover in (temporary, importlib.util.cache_from_source(temporary)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    print(f"Wrote {out}: {n_nodes} nodes, {len(source) / 1024:.0f} kB in {time.perf_counter() - start:.1f} s, "
+          f"imports in {import_ms:.0f} ms, identical to sklearn on {checked} rows")
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate pure Python/NumPy predictor modules from trained models")
+    parser.add_argument("diseases", nargs="*", help=f"diseases to export (default: all of {', '.join(train.CONFIG)})")
+    parser.add_argument("--variant", choices=train.VARIANTS, default="full")
+    parser.add_argument("--model-dir", default=os.path.join("models", "{variant}"),
+                        help="directory of the models, may contain {variant} and {disease}")
+    parser.add_argument("--distilled", action="store_true", help="export the trees distill.py wrote instead")
+    parser.add_argument("--split-depth", type=int, default=SPLIT_DEPTH,
+                        help="tree levels per function before a subtree moves into a helper")
+    parser.add_argument("--max-nodes", type=int, default=200_000, help="skip models with more nodes than this")
+    parser.add_argument("--rows", type=int, default=2000, help="random rows per kind in the parity test")
+    args = parser.parse_args(argv)
+
+    diseases = args.diseases or list(train.CONFIG)
+    unknown = [disease for disease in diseases if disease not in train.CONFIG]
+    if unknown:
+        parser.error(f"unknown disease(s): {', '.join(unknown)}")
+
+    failed = False
+    for disease in diseases:
+        path = train.model_path(disease, args.variant, args.model_dir)
+        if args.distilled:
+            path = os.path.join(os.path.dirname(path), distilled_filename(os.path.basename(path)))
+        try:
+            export(path, args.split_depth, args.max_nodes, args.rows)
+        except ValueError as e:
+            print(e)
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# Reads only the requested columns of a CSV with declared compact dtypes.
+# With chunksize the file is streamed in pieces and only the typed chunks
+# are kept, so the text parser never holds the whole file at once.
+def read_dataset(path, columns=None, dtypes=None, chunksize=None):
+    dtypes = dtypes or {}
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+        dtypes = {column: dtype for column, dtype in dtypes.items() if column in columns}
+
+    start = time.perf_counter()
+    reader = pd.read_csv(path, usecols=columns, dtype=dtypes, chunksize=chunksize)
+    df = pd.concat(reader, ignore_index=True) if chunksize else reader
+    if columns is not None:
+        # usecols keeps the file's column order, callers get theirs
+        df = df[columns]
+
+    print(f"Read {os.path.basename(path)}: {len(df)} rows x {len(df.columns)} columns, "
+          f"{frame_mb(df):.1f} MB in {time.perf_counter() - start:.2f} s")
+    return df
+
+
+def frame_mb(df):
+    return df.memory_usage(index=False, deep=True).sum() / 2**20
+
+
+# Bumped whenever the layout of a cache entry changes
+CACHE_FORMAT = 2
+
+
+# Cache key of an encoded dataset: the bytes of the source CSV plus
+# everything that decides how it is read and encoded
+def fingerprint(path, settings):
+    with open(path, "rb") as source:
+        digest = hashlib.file_digest(source, "sha256")
+    digest.update(json.dumps([CACHE_FORMAT, settings], sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:20]
+
+
+# Encoded datasets are cached as one .npy file per column plus a JSON file
+# with the column names and any metadata (the fitted vocabularies), and
+# loaded back memory-mapped as (df, metadata)
+def load_cached(directory, mmap=True):
+    try:
+        with open(os.path.join(directory, "columns.json")) as handle:
+            entry = json.load(handle)
+    except FileNotFoundError:
+        return None
+    columns = entry["columns"]
+    mmap_mode = "r" if mmap else None
+    arrays = {column: np.load(os.path.join(directory, f"{index}.npy"), mmap_mode=mmap_mode)
+              for index, column in enumerate(columns)}
+    return pd.DataFrame(arrays, copy=False), entry["metadata"]
+
+
+def store_cached(directory, df, metadata=None):
+    # Only plain numeric columns can be stored without pickling
+    if any(dtype.kind not in "biuf" for dtype in df.dtypes):
+        return False
+
+    # Written to a temporary directory and renamed into place, so a reader
+    # never sees a half-written entry
+    parent = os.path.dirname(directory) or "."
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+    try:
+        for index, column in enumerate(df.columns):
+            np.save(os.path.join(temporary, f"{index}.npy"), df[column].to_numpy(), allow_pickle=False)
+        with open(os.path.join(temporary, "columns.json"), "w") as handle:
+            json.dump({"columns": list(df.columns), "metadata": metadata}, handle)
+        os.replace(temporary, directory)
+    except OSError:
+        # Another process stored the same entry first
+        if not os.path.exists(os.path.join(directory, "columns.json")):
+            raise
+    finally:
+        if os.path.exists(temporary):
+            shutil.rmtree(temporary)
+    return True
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+from sklearn.tree import DecisionTreeRegressor, export_text
+
+import train
+from forest_engine import ForestEngine, compact
+from model_store import distilled_filename, save_model, single_row_latency_us
+
+
+def sample(X, n_samples, rng):
+    # The given rows plus rows whose every column is drawn on its own from
+    # that column's values, covering answer combinations the data never had
+    extra = max(0, n_samples - len(X))
+    synthetic = pd.DataFrame({column: rng.choice(X[column].to_numpy(), extra) for column in X.columns})
+    return pd.concat([X, synthetic.astype(X.dtypes.to_dict())], ignore_index=True)
+
+
+def distill(forest, X, max_depth=8, min_samples_leaf=20, random_state=0):
+    # One regression tree fitted on the forest's class probabilities; each
+    # leaf predicts the mean probabilities of the sample rows that reach it
+    tree = DecisionTreeRegressor(max_depth=max_depth, min_samples_leaf=min_samples_leaf, random_state=random_state)
+    tree.fit(X, forest.predict_proba(X))
+    # The engines read a tree regressor with classes_ as one fitted on the
+    # probabilities of those classes
+    tree.classes_ = forest.classes_
+    return tree
+
+
+def compare(forest, tree, X_test, y_test, X_synthetic):
+    # Agreement of the predicted classes on the holdout rows and on unseen
+    # synthetic rows, the AUC of both models, and the single-row latency of
+    # the engines the servers would build from them
+    features = list(X_test.columns)
+    forest_engine = compact(ForestEngine.from_model(forest, features))
+    tree_engine = compact(ForestEngine.from_model(tree, features))
+    forest_proba = forest_engine.predict_proba(X_test)
+    tree_proba = tree_engine.predict_proba(X_test)
+    return {
+        "depth": int(tree.get_depth()),
+        "leaves": int(tree.get_n_leaves()),
+        "agreement": float(np.mean(forest_proba.argmax(axis=1) == tree_proba.argmax(axis=1))),
+        "synthetic_agreement": float(np.mean(forest_engine.predict(X_synthetic) == tree_engine.predict(X_synthetic))),
+        "mean_probability_difference": float(np.abs(forest_proba[:, 1] - tree_proba[:, 1]).mean()),
+        "forest_auc": roc_auc_score(y_test, forest_proba[:, 1]),
+        "distilled_auc": roc_auc_score(y_test, tree_proba[:, 1]),
+        "forest_latency_us": single_row_latency_us(forest_engine, X_test),
+        "distilled_latency_us": single_row_latency_us(tree_engine, X_test),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit a single shallow tree that mimics a trained forest")
+    parser.add_argument("disease", choices=list(train.CONFIG))
+    parser.add_argument("variant", choices=train.VARIANTS)
+    parser.add_argument("--depth", type=int, default=8, help="maximum depth of the distilled tree")
+    parser.add_argument("--min-samples-leaf", type=int, default=20, help="fewest sample rows per leaf")
+    parser.add_argument("--samples", type=int, default=200_000,
+                        help="rows labeled by the forest: the training rows, topped up with synthetic ones")
+    parser.add_argument("--model-dir", default=os.path.join("models", "{variant}"),
+                        help="directory of the forest, may contain {variant} and {disease}")
+    parser.add_argument("--data-dir", default=".", help="directory holding the CSV files")
+    parser.add_argument("--cache-dir", default=".dataset_cache", help="encoded dataset cache ('' disables it)")
+    parser.add_argument("--rules", action="store_true", help="also write the tree as a text rule list")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    path = train.model_path(args.disease, args.variant, args.model_dir)
+    forest = joblib.load(path)
+    df, _ = train.load_dataset(args.disease, args.data_dir, [args.variant], cache_dir=args.cache_dir)
+    X_train, X_test, _, y_test = train.split(args.disease, args.variant, df)
+
+    rng = np.random.default_rng(args.seed)
+    X_sample = sample(X_train, args.samples, rng)
+    start = time.perf_counter()
+    tree = distill(forest, X_sample, args.depth, args.min_samples_leaf, args.seed)
+    fit_seconds = time.perf_counter() - start
+
+    # Synthetic rows drawn after the fit, so none of them was in the sample
+    X_synthetic = sample(X_train, len(X_train) + 10_000, rng).iloc[len(X_train):]
+    report = {
+        "disease": args.disease,
+        "variant": args.variant,
+        "samples": len(X_sample),
+        "fit_seconds": fit_seconds,
+        **compare(forest, tree, X_test, y_test, X_synthetic),
+    }
+    print(f"{args.disease}/{args.variant}: depth {report['depth']}, {report['leaves']} leaves from "
+          f"{report['samples']} rows in {fit_seconds:.1f} s")
+    print(f"Agreement with the forest {report['agreement']:.1%} on the holdout, "
+          f"{report['synthetic_agreement']:.1%} on synthetic rows; "
+          f"AUC {report['distilled_auc']:.3f} vs {report['forest_auc']:.3f}")
+    print(f"Single row: {report['distilled_latency_us']:.0f} us vs {report['forest_latency_us']:.0f} us")
+
+    # Written next to the forest, where the servers look for it when the
+    # disease is listed in DISTILLED_MODELS
+    out = os.path.join(os.path.dirname(path), distilled_filename(os.path.basename(path)))
+    save_model(tree, out)
+    stem = os.path.splitext(out)[0]
+    with open(stem + ".json", "w") as handle:
+        json.dump(report, handle, indent=2)
+    if args.rules:
+        with open(stem + ".txt", "w") as handle:
+            handle.write(export_text(tree, feature_names=list(X_train.columns), decimals=3))
+    print("Wrote", out)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# Vectorized column encoder for the training datasets. Steps run in order:
+#   ("replace", {column: mapping})     values outside the mapping are kept
+#   ("map", {column: mapping})         values outside the mapping become NaN
+#   ("label", {column: categories})    code of each value in categories
+#   ("onehot", {column: categories})   one sparse 0/1 column per category
+# Label and one-hot steps whose categories are None learn them (sorted, as
+# LabelEncoder does) on fit; pinned categories are used as given, so the
+# codes match what the servers send. Every lookup is a Series.map or
+# Categorical codes call, never a Python function per cell.
+class Encoder:
+
+    def __init__(self, steps, vocabularies=None):
+        self.steps = steps
+        self.vocabularies = dict(vocabularies or {})
+
+    def fit(self, df):
+        for kind, spec in self.steps:
+            if kind not in ("label", "onehot"):
+                continue
+            for column, categories in spec.items():
+                if column not in df:
+                    continue
+                if categories is None:
+                    categories = sorted(df[column].dropna().unique().tolist())
+                self.vocabularies[column] = list(categories)
+        return self
+
+    def transform(self, df):
+        # Steps skip columns that were not read
+        df = df.copy(deep=False)
+        for kind, spec in self.steps:
+            columns = [column for column in spec if column in df]
+            if kind == "replace":
+                for column in columns:
+                    df[column] = replace(df[column], spec[column])
+            elif kind == "map":
+                for column in columns:
+                    df[column] = df[column].map(spec[column])
+            elif kind == "label":
+                for column in columns:
+                    df[column] = label_codes(df[column], self.vocabularies[column])
+            elif kind == "onehot":
+                for column in columns:
+                    dummies = one_hot(df[column], self.vocabularies[column])
+                    df = pd.concat([df.drop(columns=column), dummies], axis=1)
+            else:
+                raise ValueError(f"Unknown encoding step {kind!r}")
+        return df
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    def save(self, path, columns=None):
+        # Persist the vocabularies, optionally only those of some columns
+        vocabularies = {column: categories for column, categories in self.vocabularies.items()
+                        if columns is None or column in columns}
+        with open(path, "w") as handle:
+            json.dump(vocabularies, handle, indent=2)
+
+    @classmethod
+    def load(cls, path, steps):
+        with open(path) as handle:
+            return cls(steps, json.load(handle))
+
+
+def replace(series, mapping):
+    known = series.isin(list(mapping))
+    if known.all():
+        return series.map(mapping)
+    return series.map(mapping).where(known, series)
+
+
+def label_codes(series, categories):
+    codes = pd.Categorical(series, categories=categories).codes
+    missing = codes < 0
+    unknown = missing & series.notna().to_numpy()
+    if unknown.any():
+        raise ValueError(f"Values of {series.name!r} outside its vocabulary: "
+                         f"{sorted(series[unknown].unique().tolist())}")
+    if missing.any():
+        # Missing values stay missing
+        return pd.Series(np.where(missing, np.nan, codes).astype(np.float32), index=series.index)
+    dtype = np.uint8 if len(categories) <= np.iinfo(np.uint8).max + 1 else np.int64
+    return pd.Series(codes.astype(dtype), index=series.index)
+
+
+def one_hot(series, categories):
+    # Sparse columns named like OneHotEncoder's feature names; values outside
+    # the vocabulary get no 1 anywhere
+    codes = pd.Categorical(series, categories=categories).codes
+    return pd.DataFrame({
+        f"{series.name}_{category}": pd.arrays.SparseArray((codes == index).astype(np.uint8), fill_value=0)
+        for index, category in enumerate(categories)
+    }, index=series.index)
@@ -0,0 +1,361 @@
+import types
+
+import numpy as np
+
+
+# Flat-array evaluator for fitted sklearn forests.
+#
+# Every tree of the forest is packed into one set of contiguous node arrays
+# (feature, threshold, left, right, value) and a batch of rows is walked
+# through all trees at once, one tree level per step. The arithmetic mirrors
+# sklearn exactly: rows are cast to float32 before comparing against the
+# float64 thresholds, leaf probabilities are summed tree by tree in forest
+# order and then divided by the number of trees.
+class ForestEngine:
+
+    def __init__(self, feature, threshold, left, right, missing_left, value,
+                 roots, max_depth, classes, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_names = feature_names
+        self.n_trees = len(roots)
+
+    @classmethod
+    def from_model(cls, model, feature_names=None):
+        # Works for a RandomForestClassifier / ExtraTreesClassifier, a single
+        # DecisionTreeClassifier, or a DecisionTreeRegressor fitted on class
+        # probabilities and given the classes_ they belong to. Rows are
+        # indexed by position, so the column order the caller will use must
+        # match the one used in training
+        trained_names = getattr(model, "feature_names_in_", None)
+        if trained_names is not None:
+            trained_names = list(trained_names)
+            check_feature_order(feature_names, trained_names)
+        feature_names = list(feature_names) if feature_names is not None else trained_names
+
+        estimators = getattr(model, "estimators_", [model])
+        n_classes = len(model.classes_)
+
+        sizes = [estimator.tree_.node_count for estimator in estimators]
+        roots = np.zeros(len(sizes), dtype=np.intp)
+        roots[1:] = np.cumsum(sizes)[:-1]
+        n_nodes = int(sum(sizes))
+
+        feature = np.zeros(n_nodes, dtype=np.intp)
+        threshold = np.zeros(n_nodes, dtype=np.float64)
+        left = np.zeros(n_nodes, dtype=np.intp)
+        right = np.zeros(n_nodes, dtype=np.intp)
+        missing_left = np.zeros(n_nodes, dtype=bool)
+        value = np.zeros((n_nodes, n_classes), dtype=np.float64)
+        max_depth = 0
+
+        for root, estimator in zip(roots, estimators):
+            tree = estimator.tree_
+            nodes = slice(root, root + tree.node_count)
+            own = np.arange(root, root + tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # Leaves point back at themselves so extra traversal steps are no-ops
+            feature[nodes] = np.where(is_leaf, 0, tree.feature)
+            threshold[nodes] = tree.threshold
+            left[nodes] = np.where(is_leaf, own, tree.children_left + root)
+            right[nodes] = np.where(is_leaf, own, tree.children_right + root)
+            if hasattr(tree, "missing_go_to_left"):
+                missing_left[nodes] = tree.missing_go_to_left.astype(bool)
+            if hasattr(estimator, "predict_proba"):
+                value[nodes] = _leaf_probabilities(tree.value[:, 0, :n_classes])
+            else:
+                # A regression tree fitted on the class probabilities of
+                # another model (distill.py), one output per class
+                value[nodes] = tree.value[:, :n_classes, 0]
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(feature, threshold, left, right, missing_left, value,
+                   roots, max_depth, np.asarray(model.classes_), feature_names)
+
+    def apply(self, X):
+        # Leaf index of every (tree, row) pair, shape (n_trees, n_rows)
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(X.shape[0])
+        nodes = np.repeat(self.roots[:, np.newaxis], X.shape[0], axis=1)
+
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            go_left = values <= self.threshold[nodes]
+            missing = np.isnan(values)
+            if missing.any():
+                go_left = np.where(missing, self.missing_left[nodes], go_left)
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        # accumulate is strictly sequential, matching sklearn's tree-by-tree sum
+        proba = np.add.accumulate(self.value[leaves], axis=0)[-1]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+# ForestEngine with narrower node arrays and one shared table of leaf
+# probabilities, built by compact(). Nodes are numbered depth first, so the
+# left child of node i is i + 1 and only right children are stored. Leaves
+# have a NaN threshold, which no value passes, and are their own right child;
+# they hold an index into the probability table instead of a row of their own.
+class CompactForestEngine(ForestEngine):
+
+    def __init__(self, feature, threshold, right, missing_left, leaf_value, value,
+                 roots, max_depth, classes, feature_names=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.right = right
+        self.missing_left = missing_left
+        self.leaf_value = leaf_value
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.feature_names = feature_names
+        self.n_trees = len(roots)
+
+    def apply(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(X.shape[0])
+        # Node indices stay intp; indexing with the stored int32 is much slower
+        nodes = np.repeat(self.roots.astype(np.intp)[:, np.newaxis], X.shape[0], axis=1)
+
+        for _ in range(self.max_depth):
+            values = X[rows, self.feature[nodes]]
+            go_left = values <= self.threshold[nodes]
+            missing = np.isnan(values)
+            if missing.any():
+                go_left = np.where(missing, self.missing_left[nodes], go_left)
+            nodes = np.where(go_left, nodes + 1, self.right[nodes])
+
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.add.accumulate(self.value[self.leaf_value[leaves]], axis=0)[-1]
+        proba /= self.n_trees
+        return proba
+
+
+def compact(engine):
+    # Shrink a ForestEngine without changing a single prediction:
+    #  - sibling leaves with identical probabilities are merged into their
+    #    parent, repeatedly, and the nodes no longer reachable are dropped
+    #  - thresholds are rounded down to float32; rows are compared as float32,
+    #    so x <= t and x <= float32(t) rounded down agree for every row
+    #  - leaf probabilities are stored once per distinct row and stay float64,
+    #    so the per-tree sums are bit for bit the ones sklearn computes
+    #  - node indices and feature numbers use the narrowest integer type
+    n_nodes = len(engine.left)
+    own = np.arange(n_nodes)
+    left, right = engine.left.copy(), engine.right.copy()
+    is_leaf = left == own
+    # Node whose probability row a leaf predicts
+    source = own.copy()
+
+    while True:
+        candidates = np.flatnonzero(~is_leaf & is_leaf[left] & is_leaf[right])
+        same = (engine.value[source[left[candidates]]] == engine.value[source[right[candidates]]]).all(axis=1)
+        candidates = candidates[same]
+        if not len(candidates):
+            break
+        source[candidates] = source[left[candidates]]
+        left[candidates] = right[candidates] = candidates
+        is_leaf[candidates] = True
+
+    # The surviving nodes level by level from the roots
+    levels = []
+    frontier = np.asarray(engine.roots, dtype=np.intp)
+    while len(frontier):
+        levels.append(frontier)
+        internal = frontier[~is_leaf[frontier]]
+        frontier = np.concatenate([left[internal], right[internal]])
+
+    # Depth-first numbering from the subtree sizes, computed bottom up
+    size = np.ones(n_nodes, dtype=np.intp)
+    for level in reversed(levels):
+        internal = level[~is_leaf[level]]
+        size[internal] = 1 + size[left[internal]] + size[right[internal]]
+    tree_sizes = size[engine.roots]
+    position = np.zeros(n_nodes, dtype=np.intp)
+    position[engine.roots] = np.cumsum(tree_sizes) - tree_sizes
+    for level in levels:
+        internal = level[~is_leaf[level]]
+        position[left[internal]] = position[internal] + 1
+        position[right[internal]] = position[internal] + 1 + size[left[internal]]
+
+    kept = np.concatenate(levels)
+    order = np.empty(len(kept), dtype=np.intp)
+    order[position[kept]] = kept
+    leaves = is_leaf[order]
+    index_type = np.int32 if len(order) < 2**31 else np.intp
+
+    table, inverse = np.unique(engine.value[source[order[leaves]]], axis=0, return_inverse=True)
+    leaf_value = np.zeros(len(order), dtype=np.min_scalar_type(max(len(table) - 1, 0)))
+    leaf_value[leaves] = inverse.ravel()
+
+    threshold = engine.threshold[order].astype(np.float32)
+    above = threshold > engine.threshold[order]
+    threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+    threshold[leaves] = np.nan
+
+    feature = np.where(leaves, 0, engine.feature[order])
+    feature = feature.astype(np.min_scalar_type(int(feature.max(initial=0))))
+
+    return CompactForestEngine(feature, threshold,
+                               np.where(leaves, np.arange(len(order)), position[right[order]]).astype(index_type),
+                               engine.missing_left[order] & ~leaves, leaf_value, table,
+                               position[engine.roots].astype(index_type), len(levels) - 1,
+                               engine.classes_, engine.feature_names)
+
+
+def check_feature_order(feature_names, trained_names):
+    if feature_names is not None and trained_names is not None and list(feature_names) != list(trained_names):
+        raise ValueError(f"Feature order {list(feature_names)} does not match "
+                         f"the model's training order {list(trained_names)}")
+
+
+def _leaf_probabilities(value):
+    # Recent sklearn stores class fractions in tree_.value and returns them
+    # as they are; older releases stored counts and normalised at predict time
+    totals = value.sum(axis=1)
+    if np.allclose(totals[totals > 0], 1.0):
+        return value.copy()
+    totals = totals[:, np.newaxis].copy()
+    totals[totals == 0.0] = 1.0
+    return value / totals
+
+
+# Dense table of precomputed outputs for a forest whose inputs are all
+# bounded integer codes. Every combination of codes is scored once up front,
+# so serving a row is a single index computation. Rows that fall outside the
+# table (non-integer, out of range or missing values) go to the engine.
+class LookupTable:
+
+    def __init__(self, engine, cardinalities):
+        self.engine = engine
+        self.cardinalities = np.asarray(cardinalities, dtype=np.intp)
+        self.classes_ = engine.classes_
+        self.feature_names = engine.feature_names
+
+        # Row-major strides: the last feature varies fastest
+        self.strides = np.ones(len(self.cardinalities), dtype=np.intp)
+        for i in range(len(self.cardinalities) - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.cardinalities[i + 1]
+
+        grid = np.indices(self.cardinalities).reshape(len(self.cardinalities), -1).T
+        self.proba = engine.predict_proba(grid)
+        self.predictions = self.classes_.take(np.argmax(self.proba, axis=1))
+
+    def _index(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        # NaN fails every comparison, so missing values are never "valid"
+        valid = ((X >= 0) & (X < self.cardinalities) & (X == np.floor(X))).all(axis=1)
+        index = np.where(valid[:, np.newaxis], X, 0).astype(np.intp) @ self.strides
+        return X, valid, index
+
+    def predict_proba(self, X):
+        X, valid, index = self._index(X)
+        if valid.all():
+            return self.proba[index]
+        proba = np.empty((X.shape[0], self.proba.shape[1]))
+        proba[valid] = self.proba[index[valid]]
+        proba[~valid] = self.engine.predict_proba(X[~valid])
+        return proba
+
+    def predict(self, X):
+        X, valid, index = self._index(X)
+        if valid.all():
+            return self.predictions[index]
+        predictions = np.empty(X.shape[0], dtype=self.predictions.dtype)
+        predictions[valid] = self.predictions[index[valid]]
+        predictions[~valid] = self.engine.predict(X[~valid])
+        return predictions
+
+
+# Predictor for fitted models that are not forests (for example a
+# HistGradientBoostingClassifier), scored through the model's own
+# predict_proba with the rows in a DataFrame under the training column names
+class EstimatorPredictor:
+
+    def __init__(self, model, feature_names=None):
+        trained_names = getattr(model, "feature_names_in_", None)
+        if trained_names is not None:
+            trained_names = list(trained_names)
+            check_feature_order(feature_names, trained_names)
+        self.model = model
+        self.classes_ = model.classes_
+        self.feature_names = list(feature_names) if feature_names is not None else trained_names
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if self.feature_names is not None:
+            import pandas as pd
+            X = pd.DataFrame(X, columns=self.feature_names)
+        return self.model.predict_proba(X)
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def is_forest(model):
+    # A single decision tree or an ensemble averaging a flat list of them
+    if hasattr(model, "tree_"):
+        return True
+    estimators = getattr(model, "estimators_", None)
+    return isinstance(estimators, list) and bool(estimators) and all(hasattr(tree, "tree_") for tree in estimators)
+
+
+def build_engine(model, feature_names=None):
+    if is_forest(model):
+        return ForestEngine.from_model(model, feature_names)
+    return EstimatorPredictor(model, feature_names)
+
+
+def compile_predictor(model, feature_names=None, domains=None, max_table_size=1_000_000):
+    # Pick the fastest predictor for a fitted model (or an already built
+    # engine, or a predictor module generated by codegen.py): a lookup table
+    # when every feature is a bounded categorical listed in domains (feature
+    # name -> number of codes), otherwise the flat-array engine for forests
+    # and sklearn itself for anything else
+    if isinstance(model, (ForestEngine, EstimatorPredictor, types.ModuleType)):
+        engine = model
+        check_feature_order(feature_names, engine.feature_names)
+        if engine.feature_names is None and feature_names is not None:
+            engine.feature_names = list(feature_names)
+    else:
+        engine = build_engine(model, feature_names)
+    domains = domains or {}
+    names = engine.feature_names
+
+    # Generated modules score rows one by one in Python, far too slowly to
+    # fill a table at startup
+    if names is None or isinstance(engine, types.ModuleType) or not all(name in domains for name in names):
+        return engine
+
+    cardinalities = [int(domains[name]) for name in names]
+    if int(np.prod(cardinalities)) > max_table_size:
+        return engine
+    return LookupTable(engine, cardinalities)
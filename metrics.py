@@ -0,0 +1,124 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+
+# Fixed-bucket histogram, buckets are inclusive upper bounds
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "sum": total, "count": count}
+
+
+# Latency buckets in seconds, from 50 us to 2.5 s
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+# Per-disease stage timers and counters for the prediction servers, rendered
+# in the Prometheus text format. With enabled=False every call returns
+# immediately without reading the clock.
+class Metrics:
+
+    def __init__(self, enabled=True, prefix="prediction"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.stages = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def now(self):
+        return time.perf_counter() if self.enabled else 0.0
+
+    def lap(self, stage, disease, started):
+        # Record the time since started under stage and return the new mark
+        if not self.enabled:
+            return 0.0
+        now = time.perf_counter()
+        self.stages[(stage, disease or "unknown")].observe(now - started)
+        return now
+
+    def count(self, name, disease, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[(name, disease or "unknown")] += amount
+
+    def render(self, extra=()):
+        # extra holds already formatted metric families appended at the end
+        lines = []
+        if self.stages:
+            name = f"{self.prefix}_stage_seconds"
+            lines.append(f"# HELP {name} Latency of each prediction stage in seconds")
+            lines.append(f"# TYPE {name} histogram")
+            for (stage, disease), histogram in sorted(self.stages.items()):
+                lines.extend(histogram_lines(name, {"disease": disease, "stage": stage}, histogram))
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+        families = defaultdict(list)
+        for (counter, disease), value in counters:
+            families[counter].append((disease, value))
+        for counter, values in families.items():
+            name = f"{self.prefix}_{counter}_total"
+            lines.append(f"# TYPE {name} counter")
+            for disease, value in values:
+                lines.append(f'{name}{{disease="{disease}"}} {value}')
+
+        lines.extend(extra)
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name, labels, histogram):
+    snapshot = histogram.snapshot()
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    lines = [f'{name}_bucket{{{label_text},le="{bound}"}} {count}'
+             for bound, count in snapshot["buckets"].items()]
+    lines.append(f"{name}_sum{{{label_text}}} {snapshot['sum']}")
+    lines.append(f"{name}_count{{{label_text}}} {snapshot['count']}")
+    return lines
+
+
+def cache_metric_lines(cache, prefix="prediction"):
+    stats = cache.stats()
+    lines = []
+    for counter in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        name = f"{prefix}_cache_{counter}_total"
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {stats[counter]}")
+    lines.append(f"# TYPE {prefix}_cache_size gauge")
+    lines.append(f"{prefix}_cache_size {stats['size']}")
+    return lines
+
+
+def batcher_metric_lines(batchers, prefix="prediction"):
+    lines = []
+    for metric in ("queue_depth", "batch_size"):
+        name = f"{prefix}_batcher_{metric}"
+        lines.append(f"# TYPE {name} histogram")
+        for disease, batcher in sorted(batchers.items()):
+            lines.extend(histogram_lines(name, {"disease": disease}, getattr(batcher, metric)))
+    return lines
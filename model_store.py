@@ -0,0 +1,264 @@
+import argparse
+import importlib.util
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from forest_engine import ForestEngine, build_engine, compact
+
+
+# Bumped whenever the layout of the engine artifacts changes, so artifacts
+# written by an older release are rebuilt instead of loaded
+ARTIFACT_FORMAT = 2
+
+
+# Model store that keeps every forest as an uncompressed flat-array engine
+# artifact next to its pickle and loads it with read-only memory mapping.
+# Worker processes on the same host then map the same file pages instead of
+# each unpickling a private copy of every forest. Forests are compacted
+# first (see forest_engine.compact), which keeps every prediction and leaves
+# out everything else a fitted tree carries. Models that are not forests are
+# stored the same way wrapped in an EstimatorPredictor.
+class ModelStore:
+
+    def __init__(self, directory=".", mmap=True, compact=True):
+        self.directory = directory
+        self.mmap_mode = "r" if mmap else None
+        self.compact = compact
+        self.stats = {}
+        self.filenames = {}
+        self.versions = {}
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def artifact_path(self, filename):
+        stem, _ = os.path.splitext(self.path(filename))
+        return stem + ".engine"
+
+    def version(self, filename):
+        # Changes whenever the pickle (or a bare artifact) is replaced on disk
+        source = self.path(filename)
+        if not os.path.exists(source):
+            source = self.artifact_path(filename)
+        info = os.stat(source)
+        return f"{info.st_mtime_ns:x}-{info.st_size:x}"
+
+    def convert(self, filename):
+        # Unpickle the sklearn model once and write its engine arrays
+        # uncompressed, through a temporary file so concurrent workers never
+        # map a half-written artifact
+        import joblib
+        engine = build_engine(joblib.load(self.path(filename)))
+        if self.compact and isinstance(engine, ForestEngine):
+            engine = compact(engine)
+        engine.source_version = self.version(filename)
+        engine.artifact_format = self.artifact_format()
+        artifact = self.artifact_path(filename)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(artifact) or ".", suffix=".tmp")
+        os.close(handle)
+        try:
+            joblib.dump(engine, temporary, compress=0)
+            os.replace(temporary, artifact)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return artifact
+
+    def artifact_format(self):
+        return f"{ARTIFACT_FORMAT}-{'compact' if self.compact else 'full'}"
+
+    def load(self, filename, name=None):
+        name = name or filename
+        start = time.perf_counter()
+        resident_before = resident_bytes()
+
+        # The artifact records the version of the pickle it was built from and
+        # its layout, and is rebuilt whenever the pickle has been replaced (or
+        # the layout changed) since. Modules written by codegen.py are
+        # imported as they are
+        version = self.version(filename)
+        if filename.endswith(".py"):
+            engine = load_module(self.path(filename))
+            source = self.path(engine.SOURCE)
+            if os.path.exists(source) and self.version(engine.SOURCE) != engine.SOURCE_VERSION:
+                print(f"Warning: {filename} was generated from an older {engine.SOURCE}; rerun codegen.py")
+        else:
+            # joblib is imported on first use, so a server importing this
+            # module pays for it only when it loads its first artifact
+            import joblib
+            artifact = self.artifact_path(filename)
+            engine = joblib.load(artifact, mmap_mode=self.mmap_mode) if os.path.exists(artifact) else None
+            if engine is None or (os.path.exists(self.path(filename)) and (
+                    getattr(engine, "source_version", None) != version
+                    or getattr(engine, "artifact_format", None) != self.artifact_format())):
+                self.convert(filename)
+                engine = joblib.load(artifact, mmap_mode=self.mmap_mode)
+
+        self.filenames[name] = filename
+        self.versions[name] = version
+        self.stats[name] = {
+            "load_ms": (time.perf_counter() - start) * 1000,
+            "mapped_mb": engine_bytes(engine) / 2**20,
+            "resident_mb": (resident_bytes() - resident_before) / 2**20,
+        }
+        return engine
+
+    def load_all(self, filenames):
+        models = {name: self.load(filename, name) for name, filename in filenames.items()}
+        self.report()
+        return models
+
+    def refresh(self, name):
+        # Reload a model whose file changed since it was loaded, else None
+        filename = self.filenames[name]
+        if self.version(filename) == self.versions[name]:
+            return None
+        return self.load(filename, name)
+
+    def report(self):
+        for name, stats in self.stats.items():
+            print(f"Loaded {name}: {stats['load_ms']:.1f} ms, "
+                  f"{stats['mapped_mb']:.1f} MB mapped, {stats['resident_mb']:+.1f} MB resident")
+
+
+def distilled_filename(filename):
+    # Where distill.py writes the single tree that mimics a forest
+    stem, extension = os.path.splitext(filename)
+    return f"{stem}.distilled{extension}"
+
+
+def generated_filename(filename):
+    # Where codegen.py writes the predictor module generated from a model
+    return os.path.splitext(filename)[0] + "_predictor.py"
+
+
+def serving_filenames(filenames, distilled="", generated=""):
+    # The file each disease is served from: its pickle, the tree distill.py
+    # fitted to it, or the module codegen.py generated from either. distilled
+    # and generated are comma-separated disease names, as in the servers'
+    # DISTILLED_MODELS and GENERATED_MODELS. A generated module walks its
+    # trees in Python one row at a time: it beats the engine on single rows
+    # but is slower on batches (/predict_batch, micro-batching), so it only
+    # suits diseases served one request at a time
+    chosen = {}
+    for variable, names in (("DISTILLED_MODELS", distilled), ("GENERATED_MODELS", generated)):
+        chosen[variable] = {name.strip() for name in names.split(",") if name.strip()}
+        unknown = chosen[variable] - set(filenames)
+        if unknown:
+            raise ValueError(f"{variable} names unknown diseases: {', '.join(sorted(unknown))}")
+    served = {}
+    for disease, filename in filenames.items():
+        if disease in chosen["DISTILLED_MODELS"]:
+            filename = distilled_filename(filename)
+        if disease in chosen["GENERATED_MODELS"]:
+            filename = generated_filename(filename)
+        served[disease] = filename
+    return served
+
+
+def load_module(path):
+    # A fresh module object on every call, so a reload picks up a rewritten file
+    name = os.path.splitext(os.path.basename(path))[0].replace(".", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def engine_bytes(engine):
+    return sum(value.nbytes for value in vars(engine).values() if isinstance(value, np.ndarray))
+
+
+def single_row_latency_us(engine, X, repeats=200):
+    # Median time of the engine the servers use to score one row
+    row = np.asarray(X[:1], dtype=np.float64)
+    engine.predict_proba(row)
+    timings = np.empty(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        engine.predict_proba(row)
+        timings[i] = time.perf_counter() - start
+    return float(np.median(timings)) * 1e6
+
+
+def save_model(model, path):
+    # Replaced in one step, so servers reloading it never read half a file
+    import joblib
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(handle)
+    try:
+        joblib.dump(model, temporary)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def resident_bytes():
+    # Resident set size of this process; /proc is only there on Linux
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def boundary_rows(engine, n_rows=2000, seed=0):
+    # Rows whose values sit on, just above and just below the split
+    # thresholds of the full-precision engine, with some values missing:
+    # where rounding thresholds to float32 would show if it were wrong
+    rng = np.random.default_rng(seed)
+    internal = engine.left != np.arange(len(engine.left))
+    n_features = len(engine.feature_names) if engine.feature_names else int(engine.feature.max()) + 1
+    rows = np.full((n_rows, n_features), np.nan, dtype=np.float32)
+    for column in range(rows.shape[1]):
+        thresholds = engine.threshold[internal & (engine.feature == column)].astype(np.float32)
+        if len(thresholds):
+            values = rng.choice(thresholds, n_rows)
+            step = rng.integers(-1, 2, n_rows)
+            values[step > 0] = np.nextafter(values[step > 0], np.float32(np.inf))
+            values[step < 0] = np.nextafter(values[step < 0], np.float32(-np.inf))
+            rows[:, column] = np.where(rng.random(n_rows) < 0.02, np.nan, values)
+    return rows
+
+
+def check(store, filename):
+    # Pickle against artifact: size, load time and the predictions themselves
+    import joblib
+    start = time.perf_counter()
+    model = joblib.load(store.path(filename))
+    pickle_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    engine = joblib.load(store.artifact_path(filename), mmap_mode=store.mmap_mode)
+    artifact_ms = (time.perf_counter() - start) * 1000
+    print(f"{filename}: {os.path.getsize(store.path(filename)) / 1024:.0f} kB pickle, {pickle_ms:.1f} ms to load; "
+          f"{os.path.getsize(store.artifact_path(filename)) / 1024:.0f} kB artifact, {artifact_ms:.1f} ms to load")
+
+    reference = build_engine(model)
+    if isinstance(reference, ForestEngine):
+        rows = boundary_rows(reference)
+        if not np.array_equal(reference.predict_proba(rows), engine.predict_proba(rows)):
+            raise SystemExit(f"{filename}: the artifact's predictions differ from the model's")
+        print(f"{filename}: identical predictions on {len(rows)} rows at the split thresholds")
+
+
+if __name__ == "__main__":
+    # Convert pickled forests ahead of time, e.g. before starting the workers:
+    #   python model_store.py lung_cancer_model.pkl diabetes_model.pkl
+    parser = argparse.ArgumentParser(description="Convert pickled forests into memory-mappable engine artifacts")
+    parser.add_argument("models", nargs="+", help="pickled model files")
+    parser.add_argument("--dir", default=".", help="directory holding the pickles")
+    parser.add_argument("--no-compact", dest="compact", action="store_false",
+                        help="keep the full-precision node arrays")
+    parser.add_argument("--check", action="store_true",
+                        help="compare size, load time and predictions of every artifact with its pickle")
+    args = parser.parse_args()
+
+    store = ModelStore(args.dir, compact=args.compact)
+    for filename in args.models:
+        print("Wrote", store.convert(filename))
+        if args.check:
+            check(store, filename)
@@ -0,0 +1,87 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+# Bounded LRU cache of prediction results keyed by
+# (disease, model version, canonical feature tuple), with an optional TTL.
+# Entries of a disease are dropped as soon as a different model version is
+# seen for it, so replacing a model never serves stale results.
+class PredictionCache:
+
+    def __init__(self, max_size=4096, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(disease, version, row):
+        # NaN never compares equal, so missing values are keyed as None
+        return (disease, version, tuple(None if math.isnan(value) else value for value in row.tolist()))
+
+    def _check_version(self, disease, version):
+        # Caller holds the lock
+        if self.versions.get(disease, version) != version:
+            stale = [key for key in self.entries if key[0] == disease]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+        self.versions[disease] = version
+
+    def get(self, disease, version, row):
+        key = self.key(disease, version, row)
+        with self.lock:
+            self._check_version(disease, version)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, disease, version, row, value):
+        key = self.key(disease, version, row)
+        with self.lock:
+            self._check_version(disease, version)
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, disease=None):
+        with self.lock:
+            stale = [key for key in self.entries if disease is None or key[0] == disease]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
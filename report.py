@@ -0,0 +1,94 @@
+import json
+import os
+
+import numpy as np
+from sklearn.metrics import accuracy_score, classification_report, roc_auc_score, roc_curve
+
+
+# Depth of the first tree drawn in the report; the full models are too
+# wide to read past two levels
+TREE_PLOT_DEPTH = {"short": 3, "full": 2}
+
+FIGURES = ("importances", "roc", "tree")
+
+
+def evaluate(model, X_test, y_test):
+    # Score the test set once and derive every metric and curve from it
+    probabilities = model.predict_proba(X_test)
+    y_pred = model.classes_[np.argmax(probabilities, axis=1)]
+    y_prob = probabilities[:, 1]
+    fpr, tpr, _ = roc_curve(y_test, y_prob)
+    return {
+        "accuracy": accuracy_score(y_test, y_pred),
+        "auc": roc_auc_score(y_test, y_prob),
+        "classification_report": classification_report(y_test, y_pred, output_dict=True),
+        "classification_text": classification_report(y_test, y_pred),
+        "roc": {"fpr": fpr.tolist(), "tpr": tpr.tolist()},
+        "feature_names": list(X_test.columns),
+        "importances": model.feature_importances_.tolist() if hasattr(model, "feature_importances_") else None,
+    }
+
+
+def render(name, evaluation, tree, tree_depth, out_dir, formats=("png",)):
+    # Runs in a worker process; pyplot is only imported there and always
+    # with the non-interactive backend
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from sklearn.tree import plot_tree
+
+    os.makedirs(out_dir, exist_ok=True)
+    feature_names = evaluation["feature_names"]
+    written = []
+
+    def save(figure, kind):
+        for extension in formats:
+            path = os.path.join(out_dir, f"{name}_{kind}.{extension}")
+            figure.savefig(path, bbox_inches="tight")
+            written.append(path)
+        plt.close(figure)
+
+    if evaluation["importances"] is not None:
+        importances = np.asarray(evaluation["importances"])
+        indices = np.argsort(importances)
+        figure, axes = plt.subplots(figsize=(10, 6))
+        axes.set_title('Feature Importances')
+        axes.barh(range(len(indices)), importances[indices], color='b', align='center')
+        axes.set_yticks(range(len(indices)), [feature_names[i] for i in indices])
+        axes.set_xlabel('Relative Importance')
+        save(figure, "importances")
+
+    figure, axes = plt.subplots(figsize=(8, 6))
+    axes.plot(evaluation["roc"]["fpr"], evaluation["roc"]["tpr"], color='blue',
+              label=f'ROC Curve (AUC = {evaluation["auc"]:.2f})')
+    axes.plot([0, 1], [0, 1], color='red', linestyle='--')
+    axes.set_xlabel('False Positive Rate')
+    axes.set_ylabel('True Positive Rate')
+    axes.set_title('Receiver Operating Characteristic (ROC) Curve')
+    axes.legend(loc='lower right')
+    save(figure, "roc")
+
+    if tree is not None:
+        figure, axes = plt.subplots(figsize=(20, 10))
+        plot_tree(tree, feature_names=feature_names, max_depth=tree_depth, filled=True, ax=axes)
+        save(figure, "tree")
+
+    return written
+
+
+def write_summary(results, path):
+    # accuracy, AUC and the classification report of every trained model
+    summary = {
+        f"{result['disease']}/{result['variant']}": {
+            "path": result["path"],
+            "accuracy": result["accuracy"],
+            "auc": result["auc"],
+            "fit_seconds": result["fit_seconds"],
+            "classification_report": result["evaluation"]["classification_report"],
+        }
+        for result in results
+    }
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as handle:
+        json.dump(summary, handle, indent=2)
+    return path
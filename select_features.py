@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+
+import joblib
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.inspection import permutation_importance
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+import train
+
+
+def rank_features(model, X_valid, y_valid, method="impurity", n_jobs=None, random_state=0):
+    # Features from most to least important to the full model. Models
+    # without impurity importances (boosting) are always permuted
+    if method == "permutation" or not hasattr(model, "feature_importances_"):
+        importances = permutation_importance(model, X_valid, y_valid, scoring="roc_auc", n_repeats=5,
+                                             n_jobs=n_jobs, random_state=random_state).importances_mean
+    else:
+        importances = model.feature_importances_
+    return [feature for _, feature in sorted(zip(importances, X_valid.columns), key=lambda item: -item[0])]
+
+
+def subset_auc(model, features, X_fit, y_fit, X_valid, y_valid):
+    candidate = clone(model)
+    if "n_jobs" in candidate.get_params():
+        candidate.set_params(n_jobs=1)
+    candidate.fit(X_fit[features], y_fit)
+    return roc_auc_score(y_valid, candidate.predict_proba(X_valid[features])[:, 1])
+
+
+def select(disease, df, tolerance=0.01, method="impurity", max_features=None, n_jobs=None, random_state=0):
+    # Rank on the full-feature model, score every top-k prefix on a
+    # validation split of the training rows (in parallel) and keep the
+    # smallest k whose AUC is within tolerance of the full model's
+    X_train, X_test, y_train, y_test = train.split(disease, "full", df)
+    X_fit, X_valid, y_fit, y_valid = train_test_split(X_train, y_train, test_size=0.25, random_state=random_state,
+                                                      stratify=y_train)
+
+    full = train.build_estimator(disease, n_jobs=n_jobs).fit(X_fit, y_fit)
+    full_auc = roc_auc_score(y_valid, full.predict_proba(X_valid)[:, 1])
+    ranking = rank_features(full, X_valid, y_valid, method, n_jobs, random_state)
+
+    sizes = range(1, min(len(ranking), max_features or len(ranking)) + 1)
+    aucs = Parallel(n_jobs=n_jobs)(
+        delayed(subset_auc)(full, ranking[:k], X_fit, y_fit, X_valid, y_valid) for k in sizes)
+    scores = dict(zip(sizes, aucs))
+    for k, auc in scores.items():
+        print(f"  top {k:2d}: validation AUC {auc:.3f}")
+    k = next((k for k, auc in scores.items() if auc >= full_auc - tolerance), max(scores, key=scores.get))
+
+    # Keep the columns in the order of the full feature list, the order the
+    # servers and the answer schema use
+    chosen = set(ranking[:k])
+    features = [feature for feature in X_train.columns if feature in chosen]
+    reduced = train.build_estimator(disease, n_jobs=n_jobs).fit(X_train[features], y_train)
+    full = clone(full).fit(X_train, y_train)
+    return {
+        "disease": disease,
+        "features": features,
+        "ranking": ranking,
+        "method": method,
+        "validation_auc": {"full": full_auc, **{str(k): auc for k, auc in scores.items()}},
+        "test_auc_full": roc_auc_score(y_test, full.predict_proba(X_test)[:, 1]),
+        "test_auc_reduced": roc_auc_score(y_test, reduced.predict_proba(X_test[features])[:, 1]),
+    }, reduced
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pick the smallest feature subset that keeps the full model's AUC")
+    parser.add_argument("diseases", nargs="*", help=f"diseases to reduce (default: all of {', '.join(train.CONFIG)})")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="allowed validation AUC loss")
+    parser.add_argument("--method", choices=("impurity", "permutation"), default="impurity")
+    parser.add_argument("--max-features", type=int, default=None, help="largest subset to try")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="parallel subset evaluations")
+    parser.add_argument("--data-dir", default=".", help="directory holding the CSV files")
+    parser.add_argument("--cache-dir", default=".dataset_cache", help="encoded dataset cache ('' disables it)")
+    parser.add_argument("--out-dir", default=os.path.join("models", "selected"),
+                        help="where the reduced models are written, under their short model names")
+    args = parser.parse_args(argv)
+
+    diseases = args.diseases or list(train.CONFIG)
+    unknown = [disease for disease in diseases if disease not in train.CONFIG]
+    if unknown:
+        parser.error(f"unknown disease(s): {', '.join(unknown)}")
+
+    expected_features = {}
+    for disease in diseases:
+        df, encoder = train.load_dataset(disease, args.data_dir, ["full"], cache_dir=args.cache_dir)
+        print(f"Selecting features for {disease}")
+        report, reduced = select(disease, df, args.tolerance, args.method, args.max_features, args.n_jobs)
+        print(f"{disease}: {len(report['features'])} of {len(report['ranking'])} features, "
+              f"test AUC {report['test_auc_reduced']:.3f} vs {report['test_auc_full']:.3f} with all")
+
+        # The reduced model goes where the short one would, with its
+        # vocabularies and a report holding its expected_features entry
+        path = train.model_path(disease, "short", args.out_dir)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        joblib.dump(reduced, path)
+        encoder.save(os.path.splitext(path)[0] + ".vocab.json", report["features"])
+        with open(os.path.splitext(path)[0] + ".features.json", "w") as handle:
+            json.dump(report, handle, indent=2)
+        expected_features[disease] = report["features"]
+
+    print("expected_features = {")
+    for disease, features in expected_features.items():
+        print(f"    {disease!r}: {features!r},")
+    print("}")
+    return expected_features
+
+
+if __name__ == "__main__":
+    main()
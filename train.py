@@ -0,0 +1,453 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.model_selection import train_test_split
+from threadpoolctl import threadpool_limits
+
+from answer_schema import training_codes, training_labels
+from datasets import fingerprint, load_cached, read_dataset, store_cached
+from encoders import Encoder
+import report
+
+
+# Encoding with an order, shared by both thyroid variants and taken from the
+# answer codes the servers use
+THYROID_ORDINALS = {
+    column: training_codes("thyroid_cancer", column)
+    for column in ['Physical Examination', 'Adenopathy', 'Pathology', 'T', 'N', 'Stage', 'Response']
+}
+
+# How the CSVs spell the gender answers
+GENDER_VALUES = {"Female": "F", "Male": "M"}
+
+DIABETES_FEATURES = ["HighBP", "HighChol", "CholCheck", "BMI", "Smoker", "Stroke", "HeartDiseaseorAttack",
+                     "PhysActivity", "Fruits", "Veggies", "HvyAlcoholConsump", "AnyHealthcare", "NoDocbcCost",
+                     "GenHlth", "MentHlth", "PhysHlth", "DiffWalk", "Sex", "Age", "Education", "Income"]
+
+LUNG_FEATURES = ["GENDER", "AGE", "SMOKING", "YELLOW_FINGERS", "ANXIETY", "PEER_PRESSURE",
+                 "CHRONIC DISEASE", "FATIGUE ", "ALLERGY ", "WHEEZING", "ALCOHOL CONSUMING",
+                 "COUGHING", "SHORTNESS OF BREATH", "SWALLOWING DIFFICULTY", "CHEST PAIN"]
+
+# Per-disease training config. Only the target and the features of the
+# requested variants are read, with the declared dtypes; columns without
+# one (free text) are parsed as strings and turned into numbers by the
+# encoding steps (see encoders.Encoder). Label categories and ordinal codes
+# come from the answer codes in answer_schema, so a model sees the same code
+# for a value at training and at serving time. Each variant names its
+# feature subset (in the order the servers send them) and the pickle it
+# writes; "short" is served by Extra.py, "full" by Extraa.py.
+CONFIG = {
+    "diabetes": {
+        "csv_path": "Diabets_Data.csv",
+        "target": "Diabetes_binary",
+        # The BRFSS fields are 0/1 flags or small rank codes
+        "dtypes": {**dict.fromkeys(["Diabetes_binary"] + DIABETES_FEATURES, "uint8"), "BMI": "float32"},
+        "encoding": [],
+        "estimator": "forest",
+        "model_params": {},
+        "variants": {
+            "short": {
+                "features": ['BMI', 'Age', 'GenHlth', 'Income'],
+                "model_path": "diabetes_model.pkl",
+            },
+            "full": {
+                "features": DIABETES_FEATURES,
+                "model_path": "diabetes_model.pkl",
+            },
+        },
+    },
+    "Heart_Disease": {
+        "csv_path": "heart.csv",
+        "target": "target",
+        # Blood pressure and heart rate can exceed 255, which uint8 would wrap
+        "dtypes": {"age": "uint8", "sex": "uint8", "cp": "uint8", "trestbps": "uint16", "chol": "uint16",
+                   "fbs": "uint8", "restecg": "uint8", "thalach": "uint16", "exang": "uint8",
+                   "oldpeak": "float32", "slope": "uint8", "ca": "uint8", "thal": "uint8", "target": "uint8"},
+        "encoding": [],
+        "estimator": "forest",
+        "model_params": {},
+        "variants": {
+            "short": {
+                "features": ['ca', 'cp', 'oldpeak', 'thalach'],
+                "model_path": "heart_disease_model.pkl",
+            },
+            "full": {
+                "features": ["age", "sex", "cp", "trestbps", "chol", "fbs", "restecg", "thalach", "exang",
+                             "oldpeak", "slope", "ca", "thal"],
+                "model_path": "heart_disease_model.pkl",
+            },
+        },
+    },
+    "lung_cancer": {
+        "csv_path": "survey lung cancer.csv",
+        "target": "LUNG_CANCER",
+        # Symptoms are coded 1 (no) / 2 (yes)
+        "dtypes": dict.fromkeys(LUNG_FEATURES[1:], "uint8"),
+        "encoding": [
+            ("map", {'LUNG_CANCER': {'YES': 1, 'NO': 0}}),
+            ("label", {'GENDER': training_labels("lung_cancer", "GENDER", GENDER_VALUES)}),
+        ],
+        "estimator": "forest",
+        "model_params": {"random_state": 42},
+        "variants": {
+            "short": {
+                "features": ['AGE', 'ALCOHOL CONSUMING', 'ALLERGY ', 'PEER_PRESSURE'],
+                "model_path": "lung_cancer_model.pkl",
+            },
+            "full": {
+                "features": LUNG_FEATURES,
+                "model_path": "lung_cancer_model.pkl",
+            },
+        },
+    },
+    "thyroid_cancer": {
+        "csv_path": "thyroid_data (1).csv",
+        "target": "Recurred",
+        "dtypes": {"Age": "uint8"},
+        "encoding": [
+            ("replace", {column: {'No': 0, 'Yes': 1}
+                         for column in ['Smoking', 'Hx Smoking', 'Hx Radiotherapy', 'Recurred']}),
+            ("label", {
+                'Gender': training_labels("thyroid_cancer", "Gender", GENDER_VALUES),
+                'Focality': training_labels("thyroid_cancer", "Focality"),
+                'M': training_labels("thyroid_cancer", "M", {'No': 'M0', 'Yes': 'M1'}),
+            }),
+            ("map", THYROID_ORDINALS),
+        ],
+        "estimator": "forest",
+        "model_params": {},
+        "variants": {
+            "short": {
+                "features": ['Response', 'Adenopathy', 'N', 'T'],
+                "model_path": "thyroid_cancer_model.pkl",
+            },
+            "full": {
+                "features": ["Age", "Gender", "Smoking", "Hx Smoking", "Hx Radiotherapy",
+                             "Physical Examination", "Adenopathy", "Pathology", "Focality",
+                             "T", "N", "M", "Stage", "Response"],
+                "model_path": "NEW_thyroid_cancer_model.pkl",
+            },
+        },
+    },
+}
+
+VARIANTS = ("short", "full")
+
+# Estimators a model can be trained with, built from (params, n_jobs). The
+# boosting backend bins every feature once before fitting and, on more than
+# 10000 rows, stops adding trees when a held-out tenth of the training rows
+# stops improving; it threads through OpenMP rather than n_jobs, so run_job
+# caps its OpenMP threads at n_jobs instead.
+ESTIMATORS = {
+    "forest": lambda params, n_jobs: RandomForestClassifier(**params, n_jobs=n_jobs),
+    "hgb": lambda params, n_jobs: HistGradientBoostingClassifier(
+        **{"max_iter": 500, "early_stopping": "auto", "validation_fraction": 0.1, "n_iter_no_change": 10, **params}),
+}
+
+
+def build_estimator(disease, estimator=None, params=None, n_jobs=None):
+    # params (e.g. from tune.py) override the config's model_params
+    config = CONFIG[disease]
+    return ESTIMATORS[estimator or config["estimator"]]({**config["model_params"], **(params or {})}, n_jobs)
+
+
+def load_dataset(disease, data_dir=".", variants=VARIANTS, chunksize=None, cache_dir=None):
+    config = CONFIG[disease]
+    columns = [config["target"]]
+    for variant in variants:
+        columns += config["variants"][variant]["features"]
+    path = os.path.join(data_dir, config["csv_path"])
+
+    # The encoded columns are reused until the CSV or the way it is read
+    # and encoded changes
+    if cache_dir:
+        start = time.perf_counter()
+        settings = {"columns": list(dict.fromkeys(columns)), "dtypes": config["dtypes"], "encoding": config["encoding"]}
+        entry = os.path.join(cache_dir, f"{disease}-{fingerprint(path, settings)}")
+        cached = load_cached(entry)
+        if cached is not None:
+            df, vocabularies = cached
+            print(f"Loaded {disease} from {entry} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return df, Encoder(config["encoding"], vocabularies)
+
+    encoder = Encoder(config["encoding"])
+    df = encoder.fit_transform(read_dataset(path, columns, config["dtypes"], chunksize))
+    if cache_dir and store_cached(entry, df, encoder.vocabularies):
+        print(f"Cached {disease} in {entry}")
+    return df, encoder
+
+
+def model_path(disease, variant, out_dir):
+    directory = out_dir.format(variant=variant, disease=disease)
+    return os.path.join(directory, CONFIG[disease]["variants"][variant]["model_path"])
+
+
+def vocabulary_path(disease, variant, out_dir):
+    stem, _ = os.path.splitext(model_path(disease, variant, out_dir))
+    return stem + ".vocab.json"
+
+
+def deduplicate(X, y):
+    # Unique (features, label) rows and how often each one occurs
+    counts = pd.concat([X, y], axis=1).groupby(list(X.columns) + [y.name], sort=False, dropna=False).size()
+    unique = counts.index.to_frame(index=False)
+    return unique[list(X.columns)], unique[y.name], counts.to_numpy()
+
+
+def fit_weighted(model, X, y, counts):
+    # Bootstrapping the raw rows draws every unique row a multinomial number
+    # of times, so each tree is grown on its own multinomial draw of the
+    # counts as sample_weight. sklearn's weighted bootstrap would instead
+    # draw unique rows uniformly, ignoring how common each one is. The trees
+    # are grown one per fit call, so n_jobs does not parallelize them.
+    if not getattr(model, "bootstrap", False):
+        return model.fit(X, y, sample_weight=counts)
+    rng = np.random.default_rng(model.random_state)
+    n_estimators = model.n_estimators
+    model.set_params(bootstrap=False, warm_start=True)
+    for n in range(1, n_estimators + 1):
+        model.set_params(n_estimators=n)
+        model.fit(X, y, sample_weight=rng.multinomial(counts.sum(), counts / counts.sum()))
+    # The saved model keeps the parameters it was configured with, so
+    # update.py and clones of it bootstrap again
+    model.set_params(bootstrap=True, warm_start=False)
+    return model
+
+
+def split(disease, variant, df):
+    # Split into training and testing, the same way for every command
+    config = CONFIG[disease]
+    inputs = df[config["variants"][variant]["features"]]
+    target = df[config["target"]]
+    return train_test_split(inputs, target, test_size=0.2, random_state=42)
+
+
+def train_variant(disease, variant, df, out_dir, n_jobs=None, dedup=None, params=None, estimator=None):
+    X_train, X_test, y_train, y_test = split(disease, variant, df)
+
+    # Train the model
+    start = time.perf_counter()
+    model = build_estimator(disease, estimator, params, n_jobs)
+    ratio = None
+    if dedup is not None:
+        X_unique, y_unique, counts = deduplicate(X_train, y_train)
+        ratio = len(X_train) / len(X_unique)
+        print(f"{disease}/{variant}: {len(X_train)} rows -> {len(X_unique)} unique, compression {ratio:.1f}x")
+    if ratio is not None and ratio >= dedup:
+        fit_weighted(model, X_unique, y_unique, counts)
+    else:
+        model.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    # Evaluate the model; the figures are drawn later from the same numbers
+    # and the first tree
+    evaluation = report.evaluate(model, X_test, y_test)
+    print(f"{disease}/{variant}: accuracy {evaluation['accuracy']:.3f}, AUC {evaluation['auc']:.3f}, "
+          f"fit {fit_seconds:.1f} s")
+    print("Classification Report:\n", evaluation["classification_text"])
+
+    path = model_path(disease, variant, out_dir)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    joblib.dump(model, path)
+    return {"disease": disease, "variant": variant, "path": path,
+            "accuracy": evaluation["accuracy"], "auc": evaluation["auc"], "fit_seconds": fit_seconds,
+            "estimator": type(model).__name__, "compression": ratio, "evaluation": evaluation,
+            "tree": model.estimators_[0] if hasattr(model, "estimators_") else None}
+
+
+def peak_memory_mb():
+    # Peak resident set size of this process; ru_maxrss is in kB on Linux
+    # and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_job(disease, variant, df, out_dir, n_jobs, dedup=None, params=None, estimator=None):
+    # OpenMP and BLAS pools would otherwise start a thread per CPU in every
+    # worker; None leaves them alone
+    start = time.perf_counter()
+    with threadpool_limits(n_jobs):
+        result = train_variant(disease, variant, df, out_dir, n_jobs, dedup, params, estimator)
+    result["wall_seconds"] = time.perf_counter() - start
+    result["peak_memory_mb"] = peak_memory_mb()
+    return result
+
+
+def split_cpus(n_tasks, workers):
+    # Share the CPUs between n_tasks concurrent tasks and the threads of each
+    # one. Returns (workers, n_jobs): workers is the outer pool size, at most
+    # one per task, and n_jobs the inner threads each task (the trees of a
+    # forest) gets, so that workers * n_jobs never exceeds the CPU count
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, n_tasks, cpus))
+    return workers, max(1, cpus // workers)
+
+
+def spare_cpus(n_tasks, workers=None):
+    # CPUs training leaves idle: run_parallel keeps workers * n_jobs busy,
+    # in-process training (workers None) fits each forest on one thread
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        return cpus - 1
+    workers, n_jobs = split_cpus(n_tasks, workers)
+    return max(0, cpus - workers * n_jobs)
+
+
+def job_frame(disease, variant, df):
+    # Only the columns the job uses are pickled to the worker
+    config = CONFIG[disease]
+    return df[config["variants"][variant]["features"] + [config["target"]]]
+
+
+def run_parallel(jobs, datasets, out_dir, workers, dedup=None, params=None, estimator=None, on_result=None):
+    workers, n_jobs = split_cpus(len(jobs), workers)
+    params = params or {}
+    print(f"Training {len(jobs)} jobs on {workers} workers with n_jobs={n_jobs} each")
+    # A fresh process per job keeps ru_maxrss a per-job peak
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        futures = [pool.submit(run_job, disease, variant, job_frame(disease, variant, datasets[disease]),
+                               out_dir, n_jobs, dedup, params.get(f"{disease}/{variant}"), estimator)
+                   for disease, variant in jobs]
+        for future in as_completed(futures):
+            if on_result is not None:
+                on_result(future.result())
+        return [future.result() for future in futures]
+
+
+class Reporter:
+    # Draws the figures of every finished model in worker processes while
+    # training carries on, then writes the metrics summary
+    def __init__(self, directory, formats=("png",), workers=None):
+        self.directory = directory
+        self.formats = formats
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.futures = []
+
+    def submit(self, result):
+        name = f"{result['disease']}_{result['variant']}"
+        self.futures.append(self.pool.submit(
+            report.render, name, result["evaluation"], result["tree"],
+            report.TREE_PLOT_DEPTH[result["variant"]], self.directory, self.formats))
+
+    def finish(self, results):
+        written = [path for future in self.futures for path in future.result()]
+        self.pool.shutdown()
+        summary = report.write_summary(results, os.path.join(self.directory, "metrics.json"))
+        print(f"Wrote {len(written)} figures and {summary}")
+
+
+def plan(diseases, variants, out_dir):
+    jobs = [(disease, variant) for disease in diseases for variant in variants]
+    paths = {}
+    for disease, variant in jobs:
+        path = model_path(disease, variant, out_dir)
+        if path in paths:
+            raise ValueError(f"{paths[path]} and {disease}/{variant} would both write {path}; "
+                             f"put {{variant}} in --out-dir or train them separately")
+        paths[path] = f"{disease}/{variant}"
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the disease models headlessly")
+    parser.add_argument("diseases", nargs="*", help=f"diseases to train (default: all of {', '.join(CONFIG)})")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument("--data-dir", default=".", help="directory holding the CSV files")
+    parser.add_argument("--out-dir", default=os.path.join("models", "{variant}"),
+                        help="output directory, may contain {variant} and {disease}")
+    parser.add_argument("--parallel", nargs="?", type=int, const=0, default=None, metavar="WORKERS",
+                        help="train jobs concurrently in a process pool (default: as many workers as CPUs or jobs)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="stream the CSVs in chunks of this many rows")
+    parser.add_argument("--dedup", nargs="?", type=float, const=2.0, default=None, metavar="MIN_RATIO",
+                        help="fit on unique rows weighted by their counts when that shrinks the "
+                             "training set at least MIN_RATIO times (default 2); bootstrapped "
+                             "forests then grow one tree at a time, without the per-job n_jobs")
+    parser.add_argument("--estimator", choices=list(ESTIMATORS), default=None,
+                        help="estimator for every model (default: each disease's configured one)")
+    parser.add_argument("--params", default=None,
+                        help="JSON file of tuned model parameters per disease/variant, as written by tune.py")
+    parser.add_argument("--report-dir", default="reports",
+                        help="where figures and metrics.json are written (empty string skips the report)")
+    parser.add_argument("--report-formats", nargs="+", default=["png"], choices=("png", "svg"))
+    parser.add_argument("--cache-dir", default=".dataset_cache",
+                        help="where encoded datasets are cached (empty string disables the cache)")
+    args = parser.parse_args(argv)
+
+    diseases = args.diseases or list(CONFIG)
+    unknown = [disease for disease in diseases if disease not in CONFIG]
+    if unknown:
+        parser.error(f"unknown disease(s): {', '.join(unknown)}")
+    try:
+        jobs = plan(diseases, args.variants, args.out_dir)
+    except ValueError as e:
+        parser.error(str(e))
+
+    params = {}
+    if args.params:
+        with open(args.params) as handle:
+            tuning = json.load(handle)
+        # Parameters only fit the backend they were tuned for; files written
+        # before tune.py recorded it were tuned for forests
+        for job, tuned in tuning.items():
+            disease = job.split("/")[0]
+            if disease not in diseases:
+                continue
+            tuned_for = tuned.get("estimator", "forest")
+            estimator = args.estimator or CONFIG[disease]["estimator"]
+            if tuned_for != estimator:
+                parser.error(f"{args.params} holds {tuned_for} parameters for {job}, "
+                             f"which is trained with the {estimator} estimator")
+        params = {job: tuned["best"]["params"] for job, tuned in tuning.items()}
+
+    # Parse and encode each dataset once and train every variant from it
+    datasets = {}
+    for disease in dict.fromkeys(diseases):
+        datasets[disease], encoder = load_dataset(disease, args.data_dir, args.variants, args.chunksize, args.cache_dir)
+        # Each model gets the category vocabularies of its own features
+        for variant in args.variants:
+            path = vocabulary_path(disease, variant, args.out_dir)
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            encoder.save(path, CONFIG[disease]["variants"][variant]["features"])
+
+    # Figures are drawn while training runs on the CPUs it leaves spare, or
+    # once it has finished when it keeps them all busy
+    reporter = on_result = None
+    if args.report_dir:
+        spare = spare_cpus(len(jobs), args.parallel)
+        reporter = Reporter(args.report_dir, tuple(args.report_formats), spare or None)
+        on_result = reporter.submit if spare else None
+    if args.parallel is None:
+        # Run in this process; peak memory is then the running peak so far
+        results = []
+        for disease, variant in jobs:
+            results.append(run_job(disease, variant, datasets[disease], args.out_dir, None, args.dedup,
+                                   params.get(f"{disease}/{variant}"), args.estimator))
+            if on_result is not None:
+                on_result(results[-1])
+    else:
+        results = run_parallel(jobs, datasets, args.out_dir, args.parallel, args.dedup, params, args.estimator,
+                               on_result)
+
+    for result in results:
+        print(f"{result['disease']}/{result['variant']}: {result['wall_seconds']:.1f} s wall, "
+              f"{result['peak_memory_mb']:.0f} MB peak")
+    if reporter is not None:
+        if on_result is None:
+            for result in results:
+                reporter.submit(result)
+        reporter.finish(results)
+    return results
+
+
+if __name__ == "__main__":
+    main()
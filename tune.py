@@ -0,0 +1,169 @@
+import argparse
+import json
+import math
+import pickle
+import sys
+import time
+
+import numpy as np
+from sklearn.model_selection import ParameterSampler, StratifiedKFold, cross_validate
+
+import train
+from forest_engine import ForestEngine, build_engine, compact, compile_predictor
+from model_store import engine_bytes, single_row_latency_us
+
+
+# Search space of every backend in train.ESTIMATORS
+PARAM_GRIDS = {
+    "forest": {
+        "n_estimators": [25, 50, 100, 200],
+        "max_depth": [4, 8, 12, 16, None],
+        "min_samples_leaf": [1, 2, 5, 10],
+        "max_features": ["sqrt", "log2", 0.5, None],
+    },
+    "hgb": {
+        "max_iter": [50, 100, 200, 500],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "max_leaf_nodes": [7, 15, 31, 63],
+        "min_samples_leaf": [5, 20, 50],
+    },
+}
+
+
+def evaluate(disease, estimator, params, X, y, folds, cv_jobs, n_jobs):
+    # Cross-validated scores, then one fit on all rows of the round to
+    # measure what serving the candidate would cost. Forests are measured as
+    # the compact engine ModelStore serves; other models are served (and
+    # sized) as their pickle.
+    model = train.build_estimator(disease, estimator, params, n_jobs)
+    scores = cross_validate(model, X, y, cv=folds, scoring=("accuracy", "roc_auc"), n_jobs=cv_jobs)
+    model.fit(X, y)
+    engine = build_engine(model, list(X.columns))
+    if isinstance(engine, ForestEngine):
+        engine = compact(engine)
+    engine = compile_predictor(engine, list(X.columns))
+    return {
+        "params": params,
+        "rows": len(X),
+        "accuracy": float(scores["test_accuracy"].mean()),
+        "auc": float(scores["test_roc_auc"].mean()),
+        "fit_seconds": float(scores["fit_time"].mean()),
+        "latency_us": single_row_latency_us(engine, X),
+        "pickle_kb": len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1024,
+        "engine_kb": engine_bytes(engine) / 1024 if isinstance(engine, ForestEngine) else None,
+    }
+
+
+def within_latency(result, max_latency_us=None):
+    return max_latency_us is None or result["latency_us"] <= max_latency_us
+
+
+def successive_halving(disease, estimator, X, y, candidates, factor=3, n_folds=3, budget=None, random_state=0,
+                       max_latency_us=None):
+    # Every round scores the surviving candidates on factor times more rows
+    # than the last and keeps the best 1/factor, until one round has used
+    # all rows. Candidates within the latency ceiling rank first, by
+    # accuracy, and the fastest of the others fill any places left. Once the budget (seconds) is spent no new candidate
+    # is started and the last round's scores decide; the first candidate is
+    # always scored, so there is a round to decide from.
+    n_rounds = max(1, math.ceil(math.log(len(candidates), factor)))
+    order = np.random.default_rng(random_state).permutation(len(X))
+    X, y = X.iloc[order], y.iloc[order]
+
+    folds = StratifiedKFold(n_folds, shuffle=True, random_state=random_state)
+    # Folds run concurrently (outer) and each fit gets n_jobs threads (inner)
+    cv_jobs, n_jobs = train.split_cpus(n_folds, n_folds)
+    deadline = None if budget is None else time.monotonic() + budget
+
+    rounds = []
+    exhausted = False
+    for round_index in range(n_rounds):
+        rows = len(X) if round_index == n_rounds - 1 else max(
+            n_folds * 10, len(X) // factor ** (n_rounds - 1 - round_index))
+        results = []
+        for params in candidates:
+            if (rounds or results) and deadline is not None and time.monotonic() > deadline:
+                exhausted = True
+                break
+            result = evaluate(disease, estimator, params, X[:rows], y[:rows], folds, cv_jobs, n_jobs)
+            print(f"  round {round_index + 1}/{n_rounds}, {rows} rows: {params} -> "
+                  f"accuracy {result['accuracy']:.3f}, AUC {result['auc']:.3f}, {result['latency_us']:.0f} us")
+            results.append(result)
+        if results:
+            rounds.append(results)
+        if exhausted:
+            break
+        ranked = sorted(results, reverse=True, key=lambda result: (
+            (True, result["accuracy"]) if within_latency(result, max_latency_us) else (False, -result["latency_us"])))
+        candidates = [result["params"] for result in ranked[:max(1, len(ranked) // factor)]]
+    return rounds, exhausted
+
+
+def pick(results, max_latency_us=None):
+    # Most accurate candidate within the latency ceiling, else the fastest
+    allowed = [result for result in results if within_latency(result, max_latency_us)]
+    if not allowed:
+        return min(results, key=lambda result: result["latency_us"])
+    return max(allowed, key=lambda result: (result["accuracy"], result["auc"]))
+
+
+def tune(disease, variant, df, n_candidates=27, factor=3, n_folds=3, budget=None, max_latency_us=None,
+         random_state=0, estimator=None):
+    estimator = estimator or train.CONFIG[disease]["estimator"]
+    X_train, _, y_train, _ = train.split(disease, variant, df)
+    candidates = list(ParameterSampler(PARAM_GRIDS[estimator], n_candidates, random_state=random_state))
+
+    print(f"Tuning {disease}/{variant} ({estimator}): {len(candidates)} candidates on {len(X_train)} rows")
+    rounds, exhausted = successive_halving(disease, estimator, X_train, y_train, candidates, factor, n_folds,
+                                           budget, random_state, max_latency_us)
+    best = pick(rounds[-1], max_latency_us)
+    print(f"Best {disease}/{variant}: {best['params']} accuracy {best['accuracy']:.3f}, "
+          f"{best['latency_us']:.0f} us, {best['pickle_kb']:.0f} kB"
+          + (" (budget exhausted)" if exhausted else ""))
+    latency_met = within_latency(best, max_latency_us)
+    if not latency_met:
+        print(f"WARNING: no {disease}/{variant} candidate met the {max_latency_us:.0f} us latency ceiling; "
+              f"the fastest one ({best['latency_us']:.0f} us) was kept", file=sys.stderr)
+    return {"estimator": estimator, "best": best, "budget_exhausted": exhausted, "latency_met": latency_met,
+            "rounds": rounds}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Successive-halving hyperparameter search per disease model")
+    parser.add_argument("diseases", nargs="*", help=f"diseases to tune (default: all of {', '.join(train.CONFIG)})")
+    parser.add_argument("--variants", nargs="+", choices=train.VARIANTS, default=list(train.VARIANTS))
+    parser.add_argument("--data-dir", default=".", help="directory holding the CSV files")
+    parser.add_argument("--cache-dir", default=".dataset_cache", help="encoded dataset cache ('' disables it)")
+    parser.add_argument("--estimator", choices=list(PARAM_GRIDS), default=None,
+                        help="estimator to tune for every model (default: each disease's configured one)")
+    parser.add_argument("--candidates", type=int, default=27, help="parameter sets sampled from the grid")
+    parser.add_argument("--factor", type=int, default=3, help="candidates kept per round is 1/factor")
+    parser.add_argument("--folds", type=int, default=3, help="cross-validation folds, run in parallel")
+    parser.add_argument("--budget", type=float, default=None, help="wall-clock budget in seconds per model")
+    parser.add_argument("--max-latency-us", type=float, default=None,
+                        help="single-row predict latency ceiling for the winner")
+    parser.add_argument("--out", default="tuning.json", help="results file, usable as train.py --params")
+    args = parser.parse_args(argv)
+
+    diseases = args.diseases or list(train.CONFIG)
+    unknown = [disease for disease in diseases if disease not in train.CONFIG]
+    if unknown:
+        parser.error(f"unknown disease(s): {', '.join(unknown)}")
+    if args.budget is not None and args.budget <= 0:
+        parser.error("--budget must be positive")
+
+    results = {}
+    for disease in diseases:
+        df, _ = train.load_dataset(disease, args.data_dir, args.variants, cache_dir=args.cache_dir)
+        for variant in args.variants:
+            results[f"{disease}/{variant}"] = tune(disease, variant, df, args.candidates, args.factor, args.folds,
+                                                   args.budget, args.max_latency_us, estimator=args.estimator)
+
+    with open(args.out, "w") as handle:
+        json.dump(results, handle, indent=2)
+    print("Wrote", args.out)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import os
+import time
+
+import joblib
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import roc_auc_score
+
+import train
+from datasets import read_dataset
+from encoders import Encoder
+from model_store import ModelStore, save_model
+
+
+def load_batch(disease, variant, path, vocabulary):
+    # New rows come in the raw CSV layout and are encoded with the
+    # vocabularies the model was trained with. A model saved without them
+    # (older scripts, a pickle copied on its own) can still be updated when
+    # every category is pinned in CONFIG, since those are the training codes
+    config = train.CONFIG[disease]
+    columns = config["variants"][variant]["features"] + [config["target"]]
+    df = read_dataset(path, columns, config["dtypes"])
+    if os.path.exists(vocabulary):
+        encoder = Encoder.load(vocabulary, config["encoding"])
+    else:
+        learned = [column for kind, spec in config["encoding"] if kind in ("label", "onehot")
+                   for column, categories in spec.items() if categories is None and column in columns]
+        if learned:
+            raise ValueError(f"{vocabulary} is missing and the categories of {', '.join(learned)} "
+                             f"are learned in training; retrain the model to write it")
+        encoder = Encoder(config["encoding"]).fit(df)
+    df = encoder.transform(df)
+    return df[columns[:-1]], df[config["target"]]
+
+
+def grow(model, X, y, n_trees, max_trees=None, n_jobs=None):
+    # Fit n_trees more trees on the new rows only, then retire the oldest
+    # ones beyond max_trees
+    if not isinstance(getattr(model, "estimators_", None), list):
+        raise ValueError(f"Only forests can be grown, not {type(model).__name__}")
+    missing = set(model.classes_) - set(pd.unique(y))
+    if missing:
+        raise ValueError(f"New batch has no rows of class {sorted(missing)}; the new trees need every class")
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + n_trees, n_jobs=n_jobs)
+    model.fit(X, y)
+    if max_trees is not None and len(model.estimators_) > max_trees:
+        del model.estimators_[:len(model.estimators_) - max_trees]
+    model.set_params(warm_start=False, n_estimators=len(model.estimators_))
+    return model
+
+
+def compare(disease, variant, model, updated, X_new, y_new, data_dir, cache_dir, n_jobs=None):
+    # Holdout AUC of the old, the updated and a fully retrained model, all
+    # on the test split train.py holds out of the original data
+    df, _ = train.load_dataset(disease, data_dir, [variant], cache_dir=cache_dir)
+    X_train, X_test, y_train, y_test = train.split(disease, variant, df)
+
+    start = time.perf_counter()
+    retrained = clone(updated).set_params(n_jobs=n_jobs)
+    retrained.fit(pd.concat([X_train, X_new]), pd.concat([y_train, y_new]))
+    retrain_seconds = time.perf_counter() - start
+
+    return {
+        "old_auc": roc_auc_score(y_test, model.predict_proba(X_test)[:, 1]),
+        "updated_auc": roc_auc_score(y_test, updated.predict_proba(X_test)[:, 1]),
+        "retrained_auc": roc_auc_score(y_test, retrained.predict_proba(X_test)[:, 1]),
+        "retrain_seconds": retrain_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add trees fitted on newly labeled rows to a trained model")
+    parser.add_argument("disease", choices=list(train.CONFIG))
+    parser.add_argument("variant", choices=train.VARIANTS)
+    parser.add_argument("batch", help="CSV of new rows, in the layout of the training CSV")
+    parser.add_argument("--trees", type=int, default=10, help="trees to add")
+    parser.add_argument("--max-trees", type=int, default=None, help="retire the oldest trees beyond this many")
+    parser.add_argument("--model-dir", default=os.path.join("models", "{variant}"),
+                        help="directory of the model, may contain {variant} and {disease}")
+    parser.add_argument("--out", default=None, help="where to write the updated model (default: replace it)")
+    parser.add_argument("--n-jobs", type=int, default=None, help="n_jobs for fitting the new trees")
+    parser.add_argument("--compare", action="store_true",
+                        help="report holdout AUC against a full retrain on the original data plus the batch")
+    parser.add_argument("--data-dir", default=".", help="directory holding the original CSV (for --compare)")
+    parser.add_argument("--cache-dir", default=".dataset_cache", help="encoded dataset cache ('' disables it)")
+    args = parser.parse_args(argv)
+
+    path = train.model_path(args.disease, args.variant, args.model_dir)
+    out = args.out or path
+    store = ModelStore(os.path.dirname(path) or ".")
+    old_version = store.version(os.path.basename(path))
+
+    try:
+        X_new, y_new = load_batch(args.disease, args.variant, args.batch,
+                                  train.vocabulary_path(args.disease, args.variant, args.model_dir))
+    except ValueError as e:
+        parser.error(str(e))
+    model = joblib.load(path)
+    start = time.perf_counter()
+    try:
+        updated = grow(joblib.load(path), X_new, y_new, args.trees, args.max_trees, args.n_jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    update_seconds = time.perf_counter() - start
+    print(f"{args.disease}/{args.variant}: {len(model.estimators_)} -> {len(updated.estimators_)} trees "
+          f"after fitting {args.trees} on {len(X_new)} new rows in {update_seconds:.2f} s")
+
+    if args.compare:
+        report = compare(args.disease, args.variant, model, updated, X_new, y_new,
+                         args.data_dir, args.cache_dir, args.n_jobs)
+        print(f"Holdout AUC: old {report['old_auc']:.3f}, updated {report['updated_auc']:.3f}, "
+              f"full retrain {report['retrained_auc']:.3f} ({report['retrain_seconds']:.2f} s)")
+
+    save_model(updated, out)
+    store = ModelStore(os.path.dirname(out) or ".")
+    print(f"Wrote {out}, version {old_version} -> {store.version(os.path.basename(out))}")
+
+
+if __name__ == "__main__":
+    main()